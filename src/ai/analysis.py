@@ -2,7 +2,90 @@
 ai/analysis.py
 Versione Ingegneristica Definitiva.
 Ottimizzato con .bit_count() per Python 3.10+
+Il kernel dei pattern funziona sia su interi Python sia su array NumPy uint64
+(valutazione batch di molte posizioni in una sola chiamata).
 """
+import numpy as np
+
+# Direzioni dei pattern: Verticale, Orizzontale, Diagonale \, Diagonale /
+DIRECTIONS = (1, 7, 6, 8)
+
+
+def scan_patterns(my_pieces, opp_pieces, empty):
+    """
+    Kernel unico dei pattern: un solo passaggio per entrambi i giocatori.
+    Per ogni direzione di DIRECTIONS restituisce la tupla
+    (pairs, splits, trio_ends, gap_threats):
+    - pairs:       XX  (bit sul pezzo più basso della coppia)
+    - splits:      X_X (bit sul pezzo più basso)
+    - trio_ends:   caselle vuote che completano XXX_ / _XXX
+    - gap_threats: caselle vuote che completano XX_X / X_XX
+    trio_ends | gap_threats è la maschera delle minacce della direzione.
+    Output: (my_scan, opp_scan), una lista di 4 voci per giocatore.
+    Accetta interi o array uint64: con empty = ~(my | opp) nessun pattern va
+    oltre il bit 55, quindi i 64 bit di uint64 danno gli stessi valori degli interi.
+    """
+    return _scan_player(my_pieces, empty), _scan_player(opp_pieces, empty)
+
+
+def _scan_player(p, empty):
+    scan = []
+    for shift in DIRECTIONS:
+        p1 = p >> shift
+        p2 = p >> (shift * 2)
+        p3 = p >> (shift * 3)
+
+        pairs = p & p1
+        splits = p & p2
+        trios = pairs & p2
+
+        trio_ends = ((trios >> shift) | (trios << (shift * 3))) & empty
+        gap_threats = (((pairs & p3) << (shift * 2)) | ((splits & p3) << shift)) & empty
+
+        scan.append((pairs, splits, trio_ends, gap_threats))
+    return scan
+
+
+def scan_pairs_trios(my_pieces, opp_pieces, empty):
+    """
+    Variante leggera di scan_patterns per chi usa solo coppie e tris consecutivi
+    (gli evaluator dei bot di allenamento): per ogni direzione di DIRECTIONS
+    restituisce (pairs, trio_ends), senza calcolare splits e gap_threats.
+    Stessi valori delle voci omonime di scan_patterns, su interi o array uint64.
+    """
+    return _scan_pairs_trios(my_pieces, empty), _scan_pairs_trios(opp_pieces, empty)
+
+
+def _scan_pairs_trios(p, empty):
+    scan = []
+    for shift in DIRECTIONS:
+        pairs = p & (p >> shift)
+        trios = pairs & (p >> (shift * 2))
+        scan.append((pairs, ((trios >> shift) | (trios << (shift * 3))) & empty))
+    return scan
+
+
+# --- SUPPORTO BATCH (array uint64) ---
+
+_POPCOUNT_8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+
+
+def popcount(a):
+    """ Bit a 1 di ogni elemento di un array uint64 (int64, sicuro da moltiplicare). """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(a).astype(np.int64)
+    # NumPy < 2.0: tabella su ogni byte
+    a = np.ascontiguousarray(a, dtype=np.uint64)
+    return _POPCOUNT_8[a.view(np.uint8)].reshape(a.shape + (8,)).sum(axis=-1)
+
+
+def has_four(b):
+    """ Array booleano: quali bitboard contengono un 4-in-fila. """
+    found = np.zeros(np.shape(b), dtype=bool)
+    for shift in DIRECTIONS:
+        m = b & (b >> shift)
+        found |= (m & (m >> (shift * 2))) != 0
+    return found
 
 
 def get_threat_mask(my_pieces, full_mask):
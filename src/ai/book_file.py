@@ -0,0 +1,103 @@
+"""
+ai/book_file.py
+Opening Book compilato: file binario di sola lettura, pensato per il mmap.
+Layout (little-endian):
+- header: magic b"C4BK", versione, numero di record, profondità massima (4 x 4 byte)
+- entries: uint64 per record, (state_key << 3) | move_col, ordinati
+- visits:  int64 per record
+- scores:  int64 per record (total_score)
+Le mosse di uno stato sono contigue e in ordine di colonna: un lookup è
+una bisezione sull'array entries, senza copiare il file in memoria.
+"""
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+MAGIC = b"C4BK"
+VERSION = 1
+HEADER = struct.Struct("<4sIII")
+
+
+def key_depth(state_key):
+    """
+    Numero di pedine di una chiave position + mask (GameEngine.get_key()).
+    In ogni colonna alta h il segmento da 7 bit vale position + 2^h - 1,
+    cioè sta in [2^h - 1, 2^(h+1) - 2]: h = bit_length(segmento + 1) - 1.
+    """
+    depth = 0
+    for col in range(7):
+        depth += (((state_key >> (col * 7)) & 0x7F) + 1).bit_length() - 1
+    return depth
+
+
+def write_book(rows, path, max_depth):
+    """
+    Compila le righe (state_key, move_col, visits, total_score) nel file binario,
+    tenendo solo gli stati con al più max_depth pedine.
+    Restituisce il numero di record scritti.
+    """
+    records = sorted(((state_key << 3) | move_col, visits, total_score)
+                     for state_key, move_col, visits, total_score in rows
+                     if key_depth(state_key) <= max_depth)
+
+    entries = array('Q', (r[0] for r in records))
+    visits = array('q', (r[1] for r in records))
+    scores = array('q', (r[2] for r in records))
+    if sys.byteorder != "little":
+        for a in (entries, visits, scores): a.byteswap()
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(records), max_depth))
+        entries.tofile(f)
+        visits.tofile(f)
+        scores.tofile(f)
+    return len(records)
+
+
+class BinaryOpeningBook:
+    """
+    Lettore del file compilato: mmap in sola lettura (le pagine sono condivise
+    tra i processi che aprono lo stesso file) e viste tipizzate sugli array.
+    L'apertura non legge i record: costa solo il mmap e il controllo dell'header.
+    """
+
+    def __init__(self, path):
+        if sys.byteorder != "little":
+            raise ValueError("BinaryOpeningBook: il formato è little-endian, serve un host little-endian")
+
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count, max_depth = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mmap.close()
+            raise ValueError(f"{path}: non è un Opening Book compilato (versione {VERSION})")
+
+        self.count = count
+        self.max_depth = max_depth
+
+        view = memoryview(self._mmap)
+        start = HEADER.size
+        size = count * 8
+        self.entries = view[start:start + size].cast('Q')
+        self.visits = view[start + size:start + 2 * size].cast('q')
+        self.scores = view[start + 2 * size:start + 3 * size].cast('q')
+
+    def lookup(self, state_key):
+        """ Mosse note dello stato: [(move_col, visits, total_score), ...] in ordine di colonna. """
+        entries = self.entries
+        lo = bisect_left(entries, state_key << 3)
+        hi = lo
+        end = (state_key + 1) << 3
+        count = self.count
+        while hi < count and entries[hi] < end:
+            hi += 1
+        return [(entries[i] & 7, self.visits[i], self.scores[i]) for i in range(lo, hi)]
+
+    def close(self):
+        """ Rilascia le viste e il mmap. """
+        for view in (self.entries, self.visits, self.scores):
+            view.release()
+        self._mmap.close()
@@ -3,9 +3,13 @@ src/ai/bots/training_evaluators.py
 
 Evaluator specializzati per l'allenamento.
 Replicano i bias e i difetti dei vecchi bot usando la nuova tecnologia Bitboard.
-Include un fattore di 'Rumore' (Noise) per simulare l'errore umano.
+La valutazione è deterministica: l'errore umano si simula alla radice
+(MinimaxAgent randomness/temperature), così la Transposition Table resta coerente.
 """
-import random
+import numpy as np
+
+from src.ai.analysis import DIRECTIONS, scan_pairs_trios, popcount, has_four
+
 
 class TrainingBaseEvaluator:
     """
@@ -13,6 +17,10 @@ class TrainingBaseEvaluator:
     I bot specifici erediteranno da qui e cambieranno solo i PESI nel __init__.
     """
 
+    # Le coppie contano solo con il vuoto da un lato (valid_my_2): una posizione e la
+    # sua immagine speculare possono avere valori diversi, niente TT canonica.
+    mirror_symmetric = False
+
     def __init__(self):
         # Valori base
         self.SCORE_WIN = 10000000
@@ -32,11 +40,14 @@ class TrainingBaseEvaluator:
         }
         self.center_col_idx = 3 # Colonna centrale per board 7x6
 
-        # Flag per il rumore (I bot umani ce l'hanno, il Perfect Bot lo spegnerà)
-        self.use_noise = True
+    # Pesi fissi: la versione non cambia mai
+    version = 0
+
+    def prepare(self):
+        """ Pesi fissi: nulla da ricompilare prima della ricerca. """
 
     def evaluate(self, engine, player_idx):
-        # 1. Controllo Vittoria/Sconfitta (Immediata - NO RUMORE)
+        # 1. Controllo Vittoria/Sconfitta (Immediata)
         if engine.check_victory(player_idx): return self.SCORE_WIN
         opponent_idx = (player_idx + 1) % 2
         if engine.check_victory(opponent_idx): return -self.SCORE_WIN
@@ -44,8 +55,9 @@ class TrainingBaseEvaluator:
         # Recupero Bitboard
         my_pieces = engine.bitboards[player_idx]
         opp_pieces = engine.bitboards[opponent_idx]
-        full_mask = my_pieces | opp_pieces
-        empty_mask = ~full_mask
+        empty_mask = ~(my_pieces | opp_pieces)
+        # Un solo passaggio sui pattern di entrambi i giocatori (solo coppie e tris consecutivi)
+        my_scan, opp_scan = scan_pairs_trios(my_pieces, opp_pieces, empty_mask)
 
         score = 0
 
@@ -57,43 +69,68 @@ class TrainingBaseEvaluator:
         my_center_count = (my_pieces & center_mask).bit_count()
         score += (my_center_count * self.SCORE_CENTER * self.weights['center_bias'])
 
-        # 3. Analisi Pattern per Direzione
+        # 3. Analisi Pattern per Direzione (ordine di DIRECTIONS)
         # Verticale (Shift 1)
-        score += self._score_direction(my_pieces, opp_pieces, empty_mask, 1,
+        score += self._score_direction(my_scan[0], opp_scan[0], empty_mask, 1,
                                        self.weights['vertical_attack'], self.weights['vertical_defense'])
         # Orizzontale (Shift 7)
-        score += self._score_direction(my_pieces, opp_pieces, empty_mask, 7,
+        score += self._score_direction(my_scan[1], opp_scan[1], empty_mask, 7,
                                        self.weights['horizontal_attack'], self.weights['horizontal_defense'])
         # Diagonale 1 (Shift 6)
-        score += self._score_direction(my_pieces, opp_pieces, empty_mask, 6,
+        score += self._score_direction(my_scan[2], opp_scan[2], empty_mask, 6,
                                        self.weights['diagonal_attack'], self.weights['diagonal_defense'])
         # Diagonale 2 (Shift 8)
-        score += self._score_direction(my_pieces, opp_pieces, empty_mask, 8,
+        score += self._score_direction(my_scan[3], opp_scan[3], empty_mask, 8,
                                        self.weights['diagonal_attack'], self.weights['diagonal_defense'])
 
-        # 4. APPLICAZIONE RUMORE (Noise)
-        if self.use_noise:
-            noise_factor = random.uniform(0.8, 1.2)
-            score *= noise_factor
-
         return score
 
-    def _score_direction(self, my_p, opp_p, empty, shift, w_attack, w_defense):
+    def evaluate_batch(self, my_pieces, opp_pieces):
+        """
+        Come evaluate, su array uint64 di posizioni: stesso kernel e stesso
+        ordine delle operazioni, quindi gli stessi punteggi. Restituisce float64.
+        """
+        # ~ su uint64: i pattern non vanno oltre il bit 55, quindi è lo stesso vuoto di evaluate
+        empty_mask = ~(my_pieces | opp_pieces)
+        my_scan, opp_scan = scan_pairs_trios(my_pieces, opp_pieces, empty_mask)
+
+        center_mask = 0
+        for r in range(6):
+            center_mask |= (1 << (self.center_col_idx * 7 + r))
+
+        score = popcount(my_pieces & np.uint64(center_mask)) * self.SCORE_CENTER * self.weights['center_bias']
+
+        directions = (('vertical_attack', 'vertical_defense'), ('horizontal_attack', 'horizontal_defense'),
+                      ('diagonal_attack', 'diagonal_defense'), ('diagonal_attack', 'diagonal_defense'))
+        for i, (attack, defense) in enumerate(directions):
+            score = score + self._score_direction_batch(my_scan[i], opp_scan[i], empty_mask, DIRECTIONS[i],
+                                                        self.weights[attack], self.weights[defense])
+
+        score = np.where(has_four(opp_pieces), -float(self.SCORE_WIN), score)
+        return np.where(has_four(my_pieces), float(self.SCORE_WIN), score)
+
+    def _score_direction_batch(self, my_patterns, opp_patterns, empty, shift, w_attack, w_defense):
+        my_2, valid_my_3 = my_patterns
+        valid_my_2 = (my_2 >> shift) & empty
+
+        net_score = popcount(valid_my_3) * self.SCORE_3 * w_attack
+        net_score = net_score + popcount(valid_my_2) * self.SCORE_2 * w_attack
+        net_score = net_score - popcount(opp_patterns[1]) * self.DEFENSE_WEIGHT_3 * w_defense
+        return net_score
+
+    def _score_direction(self, my_patterns, opp_patterns, empty, shift, w_attack, w_defense):
         net_score = 0
 
         # --- MIEI PUNTI ---
-        my_3 = my_p & (my_p >> shift) & (my_p >> (shift * 2))
-        valid_my_3 = ((my_3 >> shift) & empty) | ((my_3 << (shift * 3)) & empty)
-
-        my_2 = my_p & (my_p >> shift)
+        my_2, valid_my_3 = my_patterns
         valid_my_2 = (my_2 >> shift) & empty
 
         net_score += valid_my_3.bit_count() * self.SCORE_3 * w_attack
         net_score += valid_my_2.bit_count() * self.SCORE_2 * w_attack
 
         # --- PUNTI AVVERSARIO ---
-        opp_3 = opp_p & (opp_p >> shift) & (opp_p >> (shift * 2))
-        valid_opp_3 = ((opp_3 >> shift) & empty) | ((opp_3 << (shift * 3)) & empty)
+        # Solo i tris consecutivi (XXX_ / _XXX): i bot non vedono i tris con buco
+        valid_opp_3 = opp_patterns[1]
 
         net_score -= valid_opp_3.bit_count() * self.DEFENSE_WEIGHT_3 * w_defense
 
@@ -129,10 +166,8 @@ class EdgeRunnerEvaluator(TrainingBaseEvaluator):
 class PerfectEvaluator(TrainingBaseEvaluator):
     """
     Gioca in modo puramente matematico e oggettivo.
-    Nessun bias, nessuna debolezza, NESSUN RUMORE (0% probabilità di errore).
+    Nessun bias, nessuna debolezza. Va usato con randomness = 0 (nessun errore).
     """
     def __init__(self):
         super().__init__()
-        # Mantiene tutti i pesi a 1.0 (Standard)
-        # SPEGNE il rumore statistico. Questo bot è deterministico e letale.
-        self.use_noise = False
\ No newline at end of file
+        # Mantiene tutti i pesi a 1.0 (Standard)
\ No newline at end of file
@@ -3,9 +3,20 @@ ai/evaluator.py
 Versione GOLD: Asimmetria Pura.
 - Difesa: Assoluta e Paranoica (x20) contro i Tris reali.
 - Attacco: Guidato dai Bias, senza calcoli di parità fantasma.
+- WindowEvaluator: stessa logica, contata in modo incrementale sulle 69 finestre.
 """
+import numpy as np
+
+from src.ai.analysis import scan_patterns, popcount, has_four
+from src.ai.windows import WindowTracker, player_counts, threat_cells
+
 
 class AdaptiveEvaluator:
+    # Il vuoto è ~(pedine): conta anche le minacce sui guardiani e oltre la colonna 6,
+    # ma non quelle prima della colonna 0, quindi una posizione e la sua immagine
+    # speculare possono avere valori diversi: niente TT canonica.
+    mirror_symmetric = False
+
     def __init__(self, profiler):
         self.profiler = profiler
 
@@ -27,121 +38,218 @@ class AdaptiveEvaluator:
         for r in range(6):
             self.CENTER_MASK |= (1 << (3 * 7 + r))
 
+        # Coefficienti precompilati dai bias del profiler (vedi prepare)
+        self._weights_version = None
+        self._coeffs = None
+        self._compile_weights()
+
+    @property
+    def version(self):
+        """ Versione dei bias: cambia a ogni aggiornamento del profiler. """
+        return self.profiler.version
+
+    def prepare(self):
+        """
+        Chiamato una volta per choose_move: ricompila i coefficienti solo se il
+        profiler ha cambiato i bias (version) dall'ultimo snapshot.
+        """
+        if self._weights_version != self.profiler.version:
+            self._compile_weights()
+
+    def _compile_weights(self):
+        """
+        Snapshot dei bias in una tupla di coefficienti pronti all'uso:
+        durante la ricerca i bias non cambiano, quindi le foglie non devono
+        più ricostruire il dict dei pesi né calcolare potenze.
+        """
+        biases = self.profiler.get_adaptive_weights()
+        threat_underestimation = biases.get('threat_underestimation', 1.0)
+        # Se l'avversario sottovaluta le minacce, allentiamo la difesa (Risk Management)
+        defense_relaxation = 1.0 / threat_underestimation
+
+        self._coeffs = (
+            self.SCORE_CENTER * biases.get('center_weight', 1.0),
+            biases.get('vertical_weakness', 1.0) ** 2,
+            biases.get('horizontal_weakness', 1.0) ** 2,
+            biases.get('diagonal_weakness', 1.0) ** 2,
+            self.SCORE_3 * self.THREAT_MULTIPLIER * defense_relaxation,
+            self.SCORE_DOUBLE_THREAT * threat_underestimation,
+            (self.SCORE_DOUBLE_THREAT * 1.5) * defense_relaxation,
+        )
+        self._weights_version = self.profiler.version
+
     def evaluate(self, engine, player_idx):
         if engine.check_victory(player_idx): return self.SCORE_WIN
         opponent_idx = (player_idx + 1) % 2
         if engine.check_victory(opponent_idx): return -self.SCORE_WIN
 
-        biases = self.profiler.get_adaptive_weights()
+        (center_w, vertical_w, horizontal_w, diagonal_w,
+         defense_w, double_threat_bonus, double_threat_malus) = self._coeffs
         my_pieces = engine.bitboards[player_idx]
         opp_pieces = engine.bitboards[opponent_idx]
-        full_mask = my_pieces | opp_pieces
+        empty = ~(my_pieces | opp_pieces)
+        # Un solo passaggio sui pattern di entrambi i giocatori
+        my_scan, opp_scan = scan_patterns(my_pieces, opp_pieces, empty)
 
         score = 0
 
         # --- 1. ATTACCO PREDATORIO (Guidato dai Bias) ---
         # Se l'avversario è debole in una direzione, il valore di quell'attacco
-        # viene amplificato per forzare situazioni che il suo depth ridotto non vede.
+        # viene amplificato (peso = bias^2) per forzare situazioni che il suo depth ridotto non vede.
 
         # Centro: Fondamentale per le diagonali
-        score += (my_pieces & self.CENTER_MASK).bit_count() * self.SCORE_CENTER * biases.get('center_weight', 1.0)
+        score += (my_pieces & self.CENTER_MASK).bit_count() * center_w
 
         # Direzioni con moltiplicatore di aggressività
-        # Se bias > 1.0, l'attacco in quella direzione diventa prioritario
-        score += self._score_position(my_pieces, full_mask, 1) * (biases.get('vertical_weakness', 1.0) ** 2)
-        score += self._score_position(my_pieces, full_mask, 7) * (biases.get('horizontal_weakness', 1.0) ** 2)
+        vertical, horizontal, diag_1, diag_2 = my_scan
+        score += self._score_position(vertical, empty, 1) * vertical_w
+        score += self._score_position(horizontal, empty, 7) * horizontal_w
 
         # Diagonali: Il punto debole tipico dei bot a basso depth.
-        # Usiamo un esponente per rendere l'IA "ossessionata" se il bias è alto.
-        diag_score = self._score_position(my_pieces, full_mask, 6) + \
-                     self._score_position(my_pieces, full_mask, 8)
-        score += diag_score * (biases.get('diagonal_weakness', 1.0) ** 2)
+        diag_score = self._score_position(diag_1, empty, 6) + \
+                     self._score_position(diag_2, empty, 8)
+        score += diag_score * diagonal_w
 
         # --- 2. DIFESA ADATTIVA (Sconto Confidenza) ---
         # Se sappiamo che l'avversario è scarso (bias alto), possiamo permetterci
         # di essere meno "paranoici" in difesa per dare priorità all'attacco vincente.
-
-        # Calcolo minacce nemiche
+        # Solo i tris reali attivano la super difesa (x THREAT_MULTIPLIER): le coppie
+        # avversarie le ignoriamo per non distrarci dal nostro attacco.
         opp_threats = 0
-        opp_threats += self._score_defense(opp_pieces, full_mask, 1)
-        opp_threats += self._score_defense(opp_pieces, full_mask, 7)
-        opp_threats += self._score_defense(opp_pieces, full_mask, 6) + \
-                       self._score_defense(opp_pieces, full_mask, 8)
-
-        # --- MIGLIORIA: Se l'avversario sottovaluta le minacce, riduciamo il peso
-        # della nostra difesa (Risk Management) per essere più aggressivi.
-        defense_relaxation = 1.0 / biases.get('threat_underestimation', 1.0)
-        score -= (opp_threats * defense_relaxation)
+        opp_threat_mask = 0
+        for _, _, trio_ends, gap_threats in opp_scan:
+            threats = trio_ends | gap_threats
+            opp_threats += threats.bit_count()
+            opp_threat_mask |= threats
+        score -= opp_threats * defense_w
 
         # Penalità centro avversario
         score -= (opp_pieces & self.CENTER_MASK).bit_count() * self.SCORE_CENTER
 
         # --- 3. FORCHETTE E TATTICA (Anti-Novizio) ---
-        # Un bot a depth 2 non può prevedere una forchetta. Se rileviamo un alto
-        # bias di sottovalutazione minacce, puntiamo tutto sulla creazione di double threats.
-
-        my_threat_mask = self._get_threat_mask(my_pieces, full_mask)
+        # Un bot a depth 2 non può prevedere una forchetta: il bonus cresce
+        # con il bias di sottovalutazione minacce dell'avversario.
+        my_threat_mask = 0
+        for _, _, trio_ends, gap_threats in my_scan:
+            my_threat_mask |= trio_ends | gap_threats
         if my_threat_mask.bit_count() >= 2:
-            # Moltiplichiamo il bonus forchetta per il bias dell'avversario
-            score += self.SCORE_DOUBLE_THREAT * biases.get('threat_underestimation', 1.0)
+            score += double_threat_bonus
 
-        # Se l'avversario ha una forchetta, è grave, ma se è un bot debole
-        # potrebbe non completarla, quindi non esageriamo con la penalità se abbiamo un attacco forte.
-        if self._get_threat_mask(opp_pieces, full_mask).bit_count() >= 2:
-            score -= (self.SCORE_DOUBLE_THREAT * 1.5) * defense_relaxation
+        # Se l'avversario ha una forchetta è grave, ma se è un bot debole
+        # potrebbe non completarla: la penalità segue il rilassamento difensivo.
+        if opp_threat_mask.bit_count() >= 2:
+            score -= double_threat_malus
 
         return score
 
-    def _score_position(self, pieces, full_mask, shift):
-        """ Calcola il punteggio OFFENSIVO """
-        score = 0
-        empty = ~full_mask
-
-        # TRIS (XXX_)
-        trios = pieces & (pieces >> shift) & (pieces >> (shift * 2))
-        open_ends = ((trios >> shift) & empty) | ((trios << (shift * 3)) & empty)
-
-        # TRIS CON BUCO (XX_X)
-        gap1 = (pieces & (pieces >> shift) & (pieces >> (shift * 3))) << (shift * 2) & empty
-        gap2 = (pieces & (pieces >> (shift * 2)) & (pieces >> (shift * 3))) << shift & empty
-
-        # Totale Tris Potenziali
-        score += (open_ends | gap1 | gap2).bit_count() * self.SCORE_3
+    def evaluate_batch(self, my_pieces, opp_pieces):
+        """
+        Come evaluate, ma su array uint64 di posizioni (my_pieces/opp_pieces
+        dal punto di vista del giocatore valutato). Stesso kernel dei pattern
+        e stesso ordine delle operazioni: il risultato coincide con evaluate.
+        Restituisce un array float64.
+        """
+        (center_w, vertical_w, horizontal_w, diagonal_w,
+         defense_w, double_threat_bonus, double_threat_malus) = self._coeffs
+        # ~ su uint64 tiene solo 64 bit, ma i pattern non vanno oltre il bit 55:
+        # stesse celle vuote (guardiani compresi) degli interi Python di evaluate
+        empty = ~(my_pieces | opp_pieces)
+        my_scan, opp_scan = scan_patterns(my_pieces, opp_pieces, empty)
+        center = np.uint64(self.CENTER_MASK)
+
+        # --- 1. ATTACCO ---
+        score = popcount(my_pieces & center) * center_w
+        score = score + self._score_position_batch(my_scan[0], empty, 1) * vertical_w
+        score = score + self._score_position_batch(my_scan[1], empty, 7) * horizontal_w
+        diag_score = self._score_position_batch(my_scan[2], empty, 6) + \
+                     self._score_position_batch(my_scan[3], empty, 8)
+        score = score + diag_score * diagonal_w
+
+        # --- 2. DIFESA ---
+        opp_threats = 0
+        opp_threat_mask = np.zeros_like(empty)
+        for _, _, trio_ends, gap_threats in opp_scan:
+            threats = trio_ends | gap_threats
+            opp_threats = opp_threats + popcount(threats)
+            opp_threat_mask |= threats
+        score = score - opp_threats * defense_w
+        score = score - popcount(opp_pieces & center) * self.SCORE_CENTER
+
+        # --- 3. FORCHETTE ---
+        my_threat_mask = np.zeros_like(empty)
+        for _, _, trio_ends, gap_threats in my_scan:
+            my_threat_mask |= trio_ends | gap_threats
+        score = np.where(popcount(my_threat_mask) >= 2, score + double_threat_bonus, score)
+        score = np.where(popcount(opp_threat_mask) >= 2, score - double_threat_malus, score)
+
+        # Posizioni già vinte (evaluate controlla prima le nostre)
+        score = np.where(has_four(opp_pieces), -float(self.SCORE_WIN), score)
+        return np.where(has_four(my_pieces), float(self.SCORE_WIN), score)
+
+    def _score_position_batch(self, patterns, empty, shift):
+        """ _score_position su array: punteggio offensivo (int64) di una direzione """
+        pairs, _, trio_ends, gap_threats = patterns
+        open_both = pairs & (empty << shift) & (empty >> (shift * 2))
+        return popcount(trio_ends | gap_threats) * self.SCORE_3 + popcount(open_both) * self.SCORE_2
+
+    def _score_position(self, patterns, empty, shift):
+        """ Calcola il punteggio OFFENSIVO di una direzione a partire dai pattern del kernel """
+        pairs, _, trio_ends, gap_threats = patterns
+
+        # Tris Potenziali (XXX_ e XX_X)
+        score = (trio_ends | gap_threats).bit_count() * self.SCORE_3
 
         # COPPIE (XX) - Importanti per costruire
-        pairs = pieces & (pieces >> shift)
-        open_both = (pairs & (empty << shift) & (empty >> (shift * 2)))
+        open_both = pairs & (empty << shift) & (empty >> (shift * 2))
         score += open_both.bit_count() * self.SCORE_2
 
         return score
 
-    def _score_defense(self, pieces, full_mask, shift):
-        """ Calcola il punteggio DIFENSIVO (Solo minacce reali) """
-        score = 0
-        empty = ~full_mask
 
-        # TRIS AVVERSARIO (Minaccia Letale)
-        trios = pieces & (pieces >> shift) & (pieces >> (shift * 2))
-        threats = ((trios >> shift) & empty) | ((trios << (shift * 3)) & empty)
+class WindowEvaluator(AdaptiveEvaluator):
+    """
+    Variante incrementale di AdaptiveEvaluator: stessi bias e coefficienti
+    (snapshot di prepare), ma i pattern sono contati sulle 69 finestre vincenti
+    da un WindowTracker agganciato all'engine e aggiornato a delta su drop/undo.
+    La foglia legge i contatori già pronti: nessuna scansione della scacchiera.
+    Coppie e tris sono contati per finestra e solo dentro la scacchiera,
+    quindi i punteggi non coincidono bit a bit con AdaptiveEvaluator.
+    """
+    # I contatori vivono nel tracker dell'engine: nessuna versione batch
+    evaluate_batch = None
+    # Solo le 69 finestre dentro la scacchiera: valori speculari, il Minimax può condividere le entry TT
+    mirror_symmetric = True
+
+    def evaluate(self, engine, player_idx):
+        tracker = engine.tracker
+        if tracker is None:
+            # Primo utilizzo su questo engine: il tracker si aggancia da solo
+            tracker = WindowTracker(engine)
+        acc = tracker.acc
+        opponent_idx = (player_idx + 1) % 2
 
-        gap1 = (pieces & (pieces >> shift) & (pieces >> (shift * 3))) << (shift * 2) & empty
-        gap2 = (pieces & (pieces >> (shift * 2)) & (pieces >> (shift * 3))) << shift & empty
+        two_v, two_h, two_d, three_v, three_h, three_d, four = player_counts(acc, player_idx)
+        if four: return self.SCORE_WIN
+        _, _, _, opp_three_v, opp_three_h, opp_three_d, opp_four = player_counts(acc, opponent_idx)
+        if opp_four: return -self.SCORE_WIN
 
-        total_threats = (threats | gap1 | gap2).bit_count()
+        (center_w, vertical_w, horizontal_w, diagonal_w,
+         defense_w, double_threat_bonus, double_threat_malus) = self._coeffs
 
-        # APPLICAZIONE MOLTIPLICATORE PAURA
-        # Solo i tris attivano la super difesa. Le coppie avversarie le ignoriamo (score 0)
-        # per non distrarci dal nostro attacco.
-        score += total_threats * (self.SCORE_3 * self.THREAT_MULTIPLIER)
+        # --- 1. ATTACCO PREDATORIO ---
+        score = (engine.bitboards[player_idx] & self.CENTER_MASK).bit_count() * center_w
+        score += (three_v * self.SCORE_3 + two_v * self.SCORE_2) * vertical_w
+        score += (three_h * self.SCORE_3 + two_h * self.SCORE_2) * horizontal_w
+        score += (three_d * self.SCORE_3 + two_d * self.SCORE_2) * diagonal_w
 
-        return score
+        # --- 2. DIFESA ADATTIVA ---
+        score -= (opp_three_v + opp_three_h + opp_three_d) * defense_w
+        score -= (engine.bitboards[opponent_idx] & self.CENTER_MASK).bit_count() * self.SCORE_CENTER
 
-    def _get_threat_mask(self, p, full_mask):
-        empty = ~full_mask
-        threats = 0
-        for d in [1, 7, 6, 8]:
-            threats |= (p >> d) & (p >> (2*d)) & (p >> (3*d)) & empty
-            threats |= (p << d) & (p >> d) & (p >> (2*d)) & empty
-            threats |= (p << (2*d)) & (p << d) & (p >> d) & empty
-            threats |= (p << (3*d)) & (p << (2*d)) & (p << d) & empty
-        return threats
\ No newline at end of file
+        # --- 3. FORCHETTE ---
+        if threat_cells(acc, player_idx) >= 2:
+            score += double_threat_bonus
+        if threat_cells(acc, opponent_idx) >= 2:
+            score -= double_threat_malus
+
+        return score
@@ -1,20 +1,269 @@
 """
 ai/minimax.py
-Versione STABLE: Transposition Table con chiave sicura (Tupla).
+Versione STABLE: Negamax + Principal Variation Search.
+Transposition Table con chiave intera univoca (position + mask).
+La TT è a capacità fissa (vedi ai/transposition.py): la memoria resta piatta.
+Make/unmake incrementale (drop_piece/undo_piece): nessuna copia di stato per nodo.
+Iterative Deepening opzionale con budget di tempo (time_ms) e aspiration windows.
+Ordinamento mosse: mossa della TT, killer moves per ply, history heuristic.
+Con un evaluator simmetrico (mirror_symmetric) la TT usa la chiave canonica rispetto
+alla simmetria speculare (posizione e riflesso condividono l'entry; la mossa
+salvata viene riflessa al bisogno).
+Mosse forzate dalle maschere bitwise dell'engine: vittoria immediata, blocco
+obbligato, doppia minaccia persa e mosse sotto una minaccia avversaria potate.
+Ricerca parallela opzionale alla radice su più processi (workers), solo a profondità
+fissa: con time_ms la ricerca resta seriale.
+Statistiche di ricerca per mossa opzionali (collect_stats): costo nullo se spente.
+Frontiera batch opzionale (batch_frontier): a depth 1 tutti i figli sono valutati
+in una sola chiamata vettoriale (evaluate_batch su array uint64).
+Errore "umano" solo alla radice (randomness / temperature): le foglie restano
+deterministiche e la TT non viene avvelenata da punteggi rumorosi.
 """
+import math
+import multiprocessing
+import os
+import pickle
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.ai.transposition import TranspositionTable
+from src.board.engine import GameEngine
+
+
+# Riflessione sinistra-destra delle chiavi (TT canonica sullo specchio)
+_mirror = GameEngine.mirror
+
+
+class _SearchTimeout(Exception):
+    """ Budget di tempo esaurito: interrompe l'iterazione in corso. """
+
+
+class SearchStats:
+    """ Contatori di una singola chiamata a choose_move. """
+
+    def __init__(self):
+        self.nodes = 0
+        self.leaf_evals = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_cutoffs = 0
+        # Beta cutoff per indice della mossa nel loop (0 = la prima provata)
+        self.beta_cutoffs = [0] * 7
+        # Profondità nominale dell'ultima ricerca completata (0 = mossa immediata/forzata)
+        self.completed_depth = 0
+        # Ply più profondo effettivamente visitato dalla radice (anche in un'iterazione interrotta)
+        self.max_depth = 0
+        self.elapsed = 0.0
+
+    @property
+    def nps(self):
+        return self.nodes / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def branching_factor(self):
+        """ Branching factor effettivo: nodi ^ (1 / profondità completata). """
+        if self.completed_depth <= 0 or self.nodes <= 0: return 0.0
+        return self.nodes ** (1.0 / self.completed_depth)
+
+    def merge(self, other):
+        """ Somma i contatori di un'altra ricerca (es. un worker parallelo). """
+        self.nodes += other.nodes
+        self.leaf_evals += other.leaf_evals
+        self.tt_probes += other.tt_probes
+        self.tt_hits += other.tt_hits
+        self.tt_cutoffs += other.tt_cutoffs
+        self.max_depth = max(self.max_depth, other.max_depth)
+        for i in range(7):
+            self.beta_cutoffs[i] += other.beta_cutoffs[i]
+
+    def to_dict(self):
+        return {
+            "nodes": self.nodes,
+            "leaf_evals": self.leaf_evals,
+            "tt_probes": self.tt_probes,
+            "tt_hits": self.tt_hits,
+            "tt_cutoffs": self.tt_cutoffs,
+            "beta_cutoffs": list(self.beta_cutoffs),
+            "completed_depth": self.completed_depth,
+            "max_depth": self.max_depth,
+            "elapsed": round(self.elapsed, 6),
+            "nps": round(self.nps, 1),
+            "branching_factor": round(self.branching_factor, 3)
+        }
+
+
+# --- RICERCA PARALLELA (lato worker) ---
+# Ogni processo tiene un MinimaxAgent per agente padre (TT e history propri)
+# e legge/aggiorna il miglior score alla radice in una cella di memoria condivisa.
+# L'agente vale per una generazione del padre (TT svuotata, evaluator e bias):
+# quando cambia, il worker riparte da TT, killer e history vuoti.
+_shared_bound = None
+_worker_agents = {}
+
+
+def _init_worker(shared_bound):
+    global _shared_bound
+    _shared_bound = shared_bound
+
+
+def _search_root_move(agent_token, generation, payload, state, col, depth, player_idx, tt_size_mb,
+                      collect_stats, batch_frontier=False):
+    """
+    Cerca una singola mossa della radice con la finestra (bound condiviso, +inf).
+    payload è l'evaluator serializzato della generazione, o None se il padre sa
+    che questo processo lo ha già ricevuto.
+    Restituisce (col, score, alpha_usato, stats, pid): se score <= alpha_usato è solo
+    un limite superiore; stats è None se le statistiche sono spente.
+    """
+    agent = _worker_agents.get(agent_token)
+    if agent is None or agent.generation != generation:
+        if payload is None:
+            raise RuntimeError("Worker senza l'evaluator della generazione corrente")
+        evaluator = pickle.loads(payload)
+        if agent is None:
+            agent = MinimaxAgent(GameEngine(), evaluator, depth, tt_size_mb, collect_stats=collect_stats)
+            _worker_agents[agent_token] = agent
+        else:
+            agent.evaluator = evaluator
+            agent.mirror_tt = getattr(evaluator, 'mirror_symmetric', False)
+            agent._clear_search_state()
+        evaluator.prepare()
+        agent.generation = generation
+    agent.batch_frontier = batch_frontier
+    agent.engine.set_state(state)
+    agent._ai_idx = player_idx
+    agent._root_ply = agent.engine.counter
+    agent._stats = SearchStats() if collect_stats else None
+    probes, hits = agent.transposition_table.probes, agent.transposition_table.hits
+
+    alpha = _shared_bound.value
+    agent.engine.drop_piece(col, player_idx)
+    score = -agent.negamax(depth - 1, float('-inf'), -alpha, 1 - player_idx, -1)
+
+    stats = agent._stats
+    if stats is not None:
+        stats.tt_probes = agent.transposition_table.probes - probes
+        stats.tt_hits = agent.transposition_table.hits - hits
+
+    if score > alpha:
+        with _shared_bound.get_lock():
+            if score > _shared_bound.value:
+                _shared_bound.value = score
+    return col, score, alpha, stats, os.getpid()
+
+
 class MinimaxAgent:
     CENTER_ORDER = [3, 2, 4, 1, 5, 0, 6]
-    FLAG_EXACT = 0
-    FLAG_LOWERBOUND = 1
-    FLAG_UPPERBOUND = 2
+    FLAG_EXACT = TranspositionTable.FLAG_EXACT
+    FLAG_LOWERBOUND = TranspositionTable.FLAG_LOWERBOUND
+    FLAG_UPPERBOUND = TranspositionTable.FLAG_UPPERBOUND
+
+    # Punteggio di vittoria: oltre questa soglia la ricerca è già risolta
+    WIN_SCORE = 10000000
+
+    # Semi-ampiezza della finestra di aspirazione attorno allo score precedente
+    # (circa un tris: il valore posizionale raramente oscilla di più tra due iterazioni)
+    ASPIRATION_WINDOW = 150
+
+    # Sotto questa profondità il costo di inviare i task supera il guadagno
+    PARALLEL_MIN_DEPTH = 4
 
-    def __init__(self, engine, evaluator, depth=4):
+    def __init__(self, engine, evaluator, depth=4, tt_size_mb=16, time_ms=None, workers=0,
+                 collect_stats=False, randomness=0.0, temperature=0.0, seed=None, batch_frontier=False):
         self.engine = engine
         self.evaluator = evaluator
         self.depth = depth
-        self.transposition_table = {}
+        self.time_ms = time_ms
 
-    def choose_move(self, player_idx):
+        # Frontiera vettoriale: solo se l'evaluator offre evaluate_batch.
+        # Conviene per molte posizioni alla volta; con 7 figli l'overhead NumPy
+        # supera il costo delle valutazioni scalari, quindi è spenta di default.
+        self.batch_frontier = batch_frontier and getattr(evaluator, 'evaluate_batch', None) is not None
+
+        # TT canonica rispetto alla simmetria speculare: solo se l'evaluator dà lo stesso
+        # valore a una posizione e alla sua immagine (mirror_symmetric), altrimenti
+        # l'entry scritta per il riflesso avrebbe un valore sbagliato.
+        self.mirror_tt = getattr(evaluator, 'mirror_symmetric', False)
+
+        # --- PERSONALITÀ (rumore alla radice) ---
+        # randomness: probabilità di una mossa a caso (svista), dopo il controllo vittoria immediata.
+        # temperature: se > 0, scelta softmax sugli score esatti della radice (in punti evaluator).
+        self.randomness = randomness
+        self.temperature = temperature
+        self.rng = random.Random(seed)
+        self.tt_size_mb = tt_size_mb
+        # Contatori probe/hit della TT solo con le statistiche: altrimenti nessun costo per probe
+        self.transposition_table = TranspositionTable(tt_size_mb, counters=collect_stats)
+
+        # Ricerca parallela: numero di processi (0/1 = ricerca seriale).
+        # Il pool viene creato alla prima ricerca e chiuso con close().
+        # Solo a profondità fissa: con time_ms (Iterative Deepening, finestre di
+        # aspirazione e timeout dentro negamax) la ricerca resta seriale.
+        self.workers = workers
+        self._pool = None
+        self._shared_bound = None
+        # Generazione vista dai worker (vedi _worker_generation), evaluator
+        # serializzato una volta per generazione e pid dei worker che lo hanno già
+        self._generation = None
+        self._payload = None
+        self._synced_workers = set()
+        # Lato worker: generazione del padre per cui valgono TT, killer e history
+        self.generation = None
+
+        # Scadenza (perf_counter) dell'iterazione corrente, None = nessun limite
+        self._deadline = None
+        # Giocatore per cui cerchiamo: le foglie sono valutate dal suo punto di vista
+        self._ai_idx = 0
+        # engine.counter alla radice: ply del nodo = counter - _root_ply (statistiche)
+        self._root_ply = 0
+
+        # Statistiche: last_stats contiene il SearchStats dell'ultima mossa.
+        # Durante la ricerca _stats è None se spente (un solo controllo per nodo).
+        self.collect_stats = collect_stats
+        self.last_stats = None
+        self._stats = None
+
+        # --- EURISTICHE DI ORDINAMENTO ---
+        # Killer: due colonne per ply assoluto (engine.counter) che hanno causato un cutoff.
+        self.killers = [[-1, -1] for _ in range(43)]
+        # History: [player][cella] -> bonus accumulato dai cutoff (celle = bit 0..48)
+        self.history = [[0] * 49, [0] * 49]
+
+    def choose_move(self, player_idx, time_ms=None, max_depth=None):
+        """
+        Sceglie la mossa per player_idx (vedi _choose_move).
+        Con collect_stats attivo, i contatori della ricerca finiscono in last_stats.
+        """
+        if not self.collect_stats:
+            return self._choose_move(player_idx, time_ms, max_depth)
+
+        stats = self._stats = SearchStats()
+        tt = self.transposition_table
+        probes, hits = tt.probes, tt.hits
+        start = time.perf_counter()
+        try:
+            return self._choose_move(player_idx, time_ms, max_depth)
+        finally:
+            stats.elapsed = time.perf_counter() - start
+            stats.tt_probes += tt.probes - probes
+            stats.tt_hits += tt.hits - hits
+            self.last_stats = stats
+            self._stats = None
+
+    def _choose_move(self, player_idx, time_ms, max_depth):
+        """
+        Sceglie la mossa per player_idx.
+        - Senza budget: ricerca a profondità fissa (max_depth, default self.depth).
+        - Con time_ms: Iterative Deepening 1, 2, 3... fino a max_depth (default:
+          celle libere) o allo scadere del tempo. Restituisce la migliore mossa
+          dell'ultima iterazione COMPLETATA; ogni iterazione prova per prima la
+          migliore mossa della precedente e cerca in una finestra di aspirazione
+          attorno al suo score. Con temperature > 0 ogni iterazione calcola gli
+          score esatti della radice e si campiona su quelli dell'ultima completata.
+        """
         # NOTA: La pulizia self.transposition_table.clear()
         # deve essere fatta SOLO all'inizio della partita nel controller!
 
@@ -24,76 +273,552 @@ class MinimaxAgent:
         for col in valid_moves:
             if self.engine.is_winning_move(col, player_idx): return col
 
+        # Svista: una mossa qualsiasi, anche ignorando una minaccia avversaria
+        if self.randomness > 0 and self.rng.random() < self.randomness:
+            return self.rng.choice(valid_moves)
+
+        # Mosse che non perdono subito: se ce n'è una sola è forzata, se non ce
+        # ne sono la partita è persa comunque e cerchiamo tra tutte.
+        non_losing = self.engine.non_losing_moves(player_idx)
+        if non_losing:
+            valid_moves = [c for c in valid_moves if non_losing & self.engine.COLUMN_MASK[c]]
+            if len(valid_moves) == 1: return valid_moves[0]
+
+        self._ai_idx = player_idx
+        self._root_ply = self.engine.counter
+        # I bias non cambiano durante la ricerca: l'evaluator li compila una volta qui
+        self.evaluator.prepare()
+
+        # Invecchiamento della history: le mosse passate pesano meno di quelle recenti
+        for table in self.history:
+            for cell in range(49):
+                table[cell] >>= 1
+
+        if time_ms is None: time_ms = self.time_ms
+        if time_ms is None:
+            depth = max_depth if max_depth is not None else self.depth
+            if self.temperature > 0:
+                best_col = self._softmax_root(valid_moves, depth, player_idx)
+            else:
+                best_col = self._search_root(valid_moves, depth, player_idx)[0]
+            if self._stats is not None: self._stats.completed_depth = depth
+            return best_col
+
+        if max_depth is None: max_depth = 42 - self.engine.counter
+        start = time.perf_counter()
+        best_col = valid_moves[0]
+        best_score = None
+        # Con temperature: mosse e score esatti dell'ultima iterazione completata
+        root_moves = root_scores = None
+        # Un timeout interrompe la ricerca a metà di drop/undo: salviamo lo
+        # stato una volta sola qui, invece di proteggere ogni nodo.
+        state_before = self.engine.get_state()
+
+        for depth in range(1, max_depth + 1):
+            # La profondità 1 viene sempre completata: garantisce una mossa sensata.
+            self._deadline = start + time_ms / 1000.0 if depth > 1 else None
+            try:
+                if self.temperature > 0:
+                    scores = self._root_scores(valid_moves, depth, player_idx)
+                    best_score = max(scores)
+                    best_col = valid_moves[scores.index(best_score)]
+                    root_moves, root_scores = list(valid_moves), scores
+                else:
+                    best_col, best_score = self._search_aspiration(valid_moves, depth, player_idx, best_score)
+            except _SearchTimeout:
+                self.engine.set_state(state_before)
+                break
+            finally:
+                self._deadline = None
+            if self._stats is not None: self._stats.completed_depth = depth
+
+            # Risultato già forzato (vittoria/sconfitta): inutile andare oltre.
+            if abs(best_score) >= self.WIN_SCORE: break
+            if time.perf_counter() - start >= time_ms / 1000.0: break
+
+            # Ordinamento: la migliore mossa trovata viene esplorata per prima
+            valid_moves.remove(best_col)
+            valid_moves.insert(0, best_col)
+
+        if root_scores is not None: return self._sample_softmax(root_moves, root_scores)
+        return best_col
+
+    # --- MOSSE IN BATCH (più partite insieme, vedi BatchGameEngine) ---
+
+    def choose_moves(self, batch, player_idx, boards):
+        """
+        Una mossa per player_idx su ciascuna scacchiera boards di un BatchGameEngine.
+        Restituisce un array di colonne allineato a boards (-1 = nessuna mossa).
+        Con depth <= 2, profondità fissa, niente statistiche e un evaluator
+        con evaluate_batch, la ricerca è vettoriale su tutte le scacchiere insieme;
+        altrimenti ogni scacchiera viene caricata nell'engine e passa da choose_move.
+        """
+        boards = np.asarray(boards, dtype=np.int64)
+        if (self.depth <= 2 and self.time_ms is None and not self.collect_stats
+                and getattr(self.evaluator, 'evaluate_batch', None) is not None):
+            return self._choose_moves_vectorized(batch, player_idx, boards)
+
+        cols = np.full(len(boards), -1, dtype=np.int64)
+        for k, i in enumerate(boards):
+            self.engine.set_state(batch.get_state(i))
+            move = self.choose_move(player_idx)
+            if move is not None: cols[k] = move
+        return cols
+
+    def _choose_moves_vectorized(self, batch, player_idx, boards):
+        """
+        Stesse regole di _choose_move (vittoria immediata, svista, mosse non perdenti,
+        mossa forzata, softmax con temperature) e lo stesso minimax a depth 1-2 con le
+        stesse mosse forzate dei nodi interni, calcolato con array (scacchiere, colonne[, colonne]).
+        Differenze: nessuna TT né ordinamento dinamico, a parità vince CENTER_ORDER.
+        """
+        order = np.array(self.CENTER_ORDER, dtype=np.int64)
+        zero = np.uint64(0)
+        board_mask = np.uint64(GameEngine.BOARD_MASK)
+        bottom_row = np.uint64(GameEngine.BOTTOM_ROW)
+        column_mask = batch.COLUMN_MASK[order]
+
+        me = batch.bitboards(player_idx)[boards]
+        opp = batch.bitboards(1 - player_idx)[boards]
+        mask = batch.mask[boards]
+        heights = batch.heights[boards][:, order]
+        valid = heights < batch.TOP_LIMIT[order]
+        # Bit di atterraggio per colonna (0 se la colonna è piena)
+        moves = np.where(valid, np.left_shift(np.uint64(1), heights.astype(np.uint64)), zero)
+
+        n = len(boards)
+        choice = np.full(n, -1, dtype=np.int64)
+        open_boards = valid.any(axis=1)
+
+        # 1. Vittoria immediata (la prima in CENTER_ORDER)
+        wins = valid & batch.has_four(me[:, None] | moves)
+        has_win = wins.any(axis=1)
+        choice[has_win] = np.argmax(wins[has_win], axis=1)
+        pending = open_boards & ~has_win
+
+        # 2. Svista alla radice, nello stesso ordine delle scacchiere
+        if self.randomness > 0:
+            for k in np.flatnonzero(pending):
+                if self.rng.random() < self.randomness:
+                    choice[k] = self.rng.choice(np.flatnonzero(valid[k]).tolist())
+                    pending[k] = False
+
+        # 3. Mosse non perdenti (come GameEngine.non_losing_moves)
+        allowed = self._non_losing_batch(me, opp, mask)
+        candidates = valid & ((moves & allowed[:, None]) != zero)
+        candidates = np.where(candidates.any(axis=1)[:, None], candidates, valid)
+        forced = pending & (candidates.sum(axis=1) == 1)
+        choice[forced] = np.argmax(candidates[forced], axis=1)
+        pending &= ~forced
+
+        if pending.any():
+            self._ai_idx = player_idx
+            self.evaluator.prepare()
+            idx = np.flatnonzero(pending)
+            scores = self._score_children_batch(me[idx], opp[idx], mask[idx], moves[idx],
+                                                column_mask, board_mask, bottom_row)
+            if self.temperature > 0:
+                # Score esatti delle mosse ammesse, in CENTER_ORDER come _root_scores
+                for row, k in enumerate(idx):
+                    cols = np.flatnonzero(candidates[k]).tolist()
+                    choice[k] = self._sample_softmax(cols, scores[row, cols].tolist())
+            else:
+                scores = np.where(candidates[idx], scores, -np.inf)
+                choice[idx] = np.argmax(scores, axis=1)
+
+        return np.where(choice >= 0, order[np.maximum(choice, 0)], -1)
+
+    @staticmethod
+    def _non_losing_batch(me, opp, mask):
+        """ GameEngine.non_losing_moves su array: maschera delle mosse che non perdono subito. """
+        board_mask = np.uint64(GameEngine.BOARD_MASK)
+        possible = (mask + np.uint64(GameEngine.BOTTOM_ROW)) & board_mask
+        opp_win = GameEngine._compute_winning_cells(opp) & (board_mask ^ mask)
+        forced = possible & opp_win
+        multiple = (forced & (forced - np.uint64(1))) != 0
+        possible = np.where(forced != 0, forced, possible)
+        return np.where(multiple, np.uint64(0), possible & ~(opp_win >> np.uint64(1)))
+
+    def _score_children_batch(self, me, opp, mask, moves, column_mask, board_mask, bottom_row):
+        """
+        Score (scacchiere, 7) di ogni mossa della radice, come _search_root:
+        depth 1 = valutazione del figlio; depth 2 = minimo sulle risposte avversarie,
+        con i controlli di negamax sul nodo figlio (niente mosse = 0, vittoria
+        avversaria immediata, nessuna risposta che non perde).
+        """
+        n = len(me)
+        child_me = me[:, None] | moves
+        child_opp = np.broadcast_to(opp[:, None], child_me.shape)
+        if self.depth <= 1:
+            return self.evaluator.evaluate_batch(child_me.ravel(), child_opp.ravel()).reshape(n, 7)
+
+        child_mask = mask[:, None] | moves
+        possible = (child_mask + bottom_row) & board_mask
+        opp_wins = GameEngine._compute_winning_cells(child_opp) & (board_mask ^ child_mask)
+        replies = self._non_losing_batch(child_opp, child_me, child_mask)
+
+        # Risposte: bit di atterraggio dell'avversario per colonna (n, 7, 7)
+        reply_bits = possible[:, :, None] & replies[:, :, None] & column_mask[None, None, :]
+        has_reply = reply_bits != 0
+        values = np.full(reply_bits.shape, np.inf)
+        values[has_reply] = self.evaluator.evaluate_batch(
+            np.broadcast_to(child_me[:, :, None], reply_bits.shape)[has_reply],
+            np.broadcast_to(child_opp[:, :, None], reply_bits.shape)[has_reply] | reply_bits[has_reply])
+        scores = values.min(axis=2)
+
+        # Controlli di negamax sul figlio, dal più prioritario
+        scores = np.where(replies == 0, float(self.WIN_SCORE - 1), scores)
+        scores = np.where((opp_wins & possible) != 0, float(-self.WIN_SCORE), scores)
+        return np.where(possible == 0, 0.0, scores)
+
+    def _search_aspiration(self, valid_moves, depth, player_idx, prev_score):
+        """
+        Ricerca dalla radice in una finestra stretta attorno allo score
+        dell'iterazione precedente; se il risultato cade fuori, ripete a finestra piena.
+        """
+        if prev_score is None or abs(prev_score) >= self.WIN_SCORE:
+            return self._search_root(valid_moves, depth, player_idx)
+
+        alpha = prev_score - self.ASPIRATION_WINDOW
+        beta = prev_score + self.ASPIRATION_WINDOW
+        best_col, best_score = self._search_root(valid_moves, depth, player_idx, alpha, beta)
+        if alpha < best_score < beta:
+            return best_col, best_score
+        return self._search_root(valid_moves, depth, player_idx)
+
+    def _search_root(self, valid_moves, depth, player_idx, alpha=float('-inf'), beta=float('inf')):
+        """
+        Ricerca PVS dalla radice. Restituisce (best_col, best_score).
+        Parallela (workers > 1) solo a finestra piena e senza scadenza.
+        """
+        if (self.workers > 1 and self._deadline is None and depth >= self.PARALLEL_MIN_DEPTH
+                and len(valid_moves) > 1 and alpha == float('-inf') and beta == float('inf')):
+            return self._search_root_parallel(valid_moves, depth, player_idx)
+
         best_score = float('-inf')
         best_col = valid_moves[0]
-        alpha = float('-inf')
-        beta = float('inf')
+        opponent_idx = 1 - player_idx
 
-        for col in valid_moves:
-            state_before = self.engine.get_state()
+        for i, col in enumerate(valid_moves):
             self.engine.drop_piece(col, player_idx)
-            score = self.minimax(self.depth - 1, False, alpha, beta, player_idx)
-            self.engine.set_state(state_before)
+            if i == 0:
+                score = -self.negamax(depth - 1, -beta, -alpha, opponent_idx, -1)
+            else:
+                # Finestra nulla: basta dimostrare che la mossa non supera alpha
+                score = -self.negamax(depth - 1, -alpha - 1, -alpha, opponent_idx, -1)
+                if alpha < score < beta:
+                    score = -self.negamax(depth - 1, -beta, -alpha, opponent_idx, -1)
+            self.engine.undo_piece(col, player_idx)
 
             if score > best_score:
                 best_score = score
                 best_col = col
             alpha = max(alpha, best_score)
+            if alpha >= beta: break
 
-        return best_col
+        return best_col, best_score
+
+    def _softmax_root(self, valid_moves, depth, player_idx):
+        """
+        Cerca ogni mossa della radice a finestra piena (score esatti) e ne
+        campiona una con probabilità proporzionale a exp(score / temperature).
+        """
+        return self._sample_softmax(valid_moves, self._root_scores(valid_moves, depth, player_idx))
 
-    def minimax(self, depth, is_maximizing, alpha, beta, ai_player_idx):
+    def _root_scores(self, valid_moves, depth, player_idx):
+        """ Score esatti (finestra piena) di ogni mossa della radice, nello stesso ordine. """
+        opponent_idx = 1 - player_idx
+        scores = []
+        for col in valid_moves:
+            self.engine.drop_piece(col, player_idx)
+            scores.append(-self.negamax(depth - 1, float('-inf'), float('inf'), opponent_idx, -1))
+            self.engine.undo_piece(col, player_idx)
+        return scores
+
+    def _sample_softmax(self, valid_moves, scores):
+        """ Campiona una mossa con probabilità proporzionale a exp(score / temperature). """
+        # Sottraiamo il massimo: i punteggi di vittoria (1e7) non vanno in overflow
+        top = max(scores)
+        weights = [math.exp((score - top) / self.temperature) for score in scores]
+        return self.rng.choices(valid_moves, weights=weights)[0]
+
+    def negamax(self, depth, alpha, beta, player_idx, color):
+        """
+        Negamax con PVS. Il valore è dal punto di vista di player_idx (chi muove);
+        color = +1 se chi muove è l'IA, -1 altrimenti (serve solo alle foglie,
+        perché l'evaluator è asimmetrico e valuta sempre per l'IA).
+        """
         alpha_orig = alpha
+        stats = self._stats
+        if stats is not None:
+            stats.nodes += 1
+            ply = self.engine.counter - self._root_ply
+            if ply > stats.max_depth: stats.max_depth = ply
 
-        # [CHIAVE SICURA] Usiamo la tupla dei bitboard. Infallibile.
-        state_key = (self.engine.bitboards[0], self.engine.bitboards[1])
+        # [CHIAVE SICURA] position + mask (come engine.get_key()): un solo intero,
+        # nessuna tupla da allocare e hashare a ogni nodo. Posizione e immagine
+        # speculare condividono l'entry (chiave canonica, la minore delle due) se
+        # l'evaluator è simmetrico (mirror_tt): la mossa salvata è nel verso
+        # canonico e va riflessa se mirrored.
+        state_key = self.engine.bitboards[0] + self.engine.mask
+        mirrored = False
+        if self.mirror_tt:
+            mirror_key = self.engine.mirrored_key
+            if mirror_key < state_key:
+                state_key = mirror_key
+                mirrored = True
 
         # 1. TT Lookup
-        if state_key in self.transposition_table:
-            tt_val, tt_depth, tt_flag = self.transposition_table[state_key]
-            if tt_depth >= depth:
-                if tt_flag == self.FLAG_EXACT: return tt_val
+        tt = self.transposition_table
+        tt_idx = tt.probe(state_key)
+        tt_move = -1
+        if tt_idx >= 0:
+            tt_move = tt.moves[tt_idx]
+            if mirrored and tt_move >= 0: tt_move = 6 - tt_move
+            if tt.depths[tt_idx] >= depth:
+                tt_val = tt.values[tt_idx]
+                tt_flag = tt.flags[tt_idx]
+                if tt_flag == self.FLAG_EXACT:
+                    if stats is not None: stats.tt_cutoffs += 1
+                    return tt_val
                 elif tt_flag == self.FLAG_LOWERBOUND: alpha = max(alpha, tt_val)
                 elif tt_flag == self.FLAG_UPPERBOUND: beta = min(beta, tt_val)
-                if alpha >= beta: return tt_val
-
-        opponent_idx = (ai_player_idx + 1) % 2
+                if alpha >= beta:
+                    if stats is not None: stats.tt_cutoffs += 1
+                    return tt_val
 
         if depth == 0:
-            return self.evaluator.evaluate(self.engine, ai_player_idx)
+            if stats is not None: stats.leaf_evals += 1
+            return color * self.evaluator.evaluate(self.engine, self._ai_idx)
 
-        if self.engine.check_victory(ai_player_idx): return 10000000 + depth
-        if self.engine.check_victory(opponent_idx): return -10000000 - depth
+        if self._deadline is not None and time.perf_counter() > self._deadline:
+            raise _SearchTimeout()
 
-        valid_moves = [c for c in self.CENTER_ORDER if self.engine.is_valid_location(c)]
-        if not valid_moves: return 0
+        # Solo chi ha appena mosso può aver completato un 4-in-fila
+        opponent_idx = 1 - player_idx
+        if self.engine.check_victory(opponent_idx): return -self.WIN_SCORE - depth
 
-        best_val = 0
-        if is_maximizing:
-            best_val = float('-inf')
-            for col in valid_moves:
-                state_before = self.engine.get_state()
-                self.engine.drop_piece(col, ai_player_idx)
-                eval = self.minimax(depth - 1, False, alpha, beta, ai_player_idx)
-                self.engine.set_state(state_before)
-                best_val = max(best_val, eval)
-                alpha = max(alpha, eval)
-                if beta <= alpha: break
+        possible = self.engine.possible_moves_mask()
+        if not possible: return 0
+        # Vittoria alla prossima mossa: stesso valore che darebbe il figlio
+        if self.engine.winning_cells(player_idx) & possible: return self.WIN_SCORE + depth - 1
+        # Nessuna mossa salva (doppia minaccia o tutte sotto una minaccia): l'avversario vince tra due ply
+        allowed = self.engine.non_losing_moves(player_idx)
+        if not allowed: return -self.WIN_SCORE - depth + 2
+
+        valid_moves = self._order_moves(player_idx, tt_move, allowed)
+
+        if depth == 1 and self.batch_frontier:
+            best_val, best_col = self._search_frontier(valid_moves, allowed, alpha, beta, player_idx, color)
         else:
-            best_val = float('inf')
-            for col in valid_moves:
-                state_before = self.engine.get_state()
-                self.engine.drop_piece(col, opponent_idx)
-                eval = self.minimax(depth - 1, True, alpha, beta, ai_player_idx)
-                self.engine.set_state(state_before)
-                best_val = min(best_val, eval)
-                beta = min(beta, eval)
-                if beta <= alpha: break
+            best_val = float('-inf')
+            best_col = -1
+            for i, col in enumerate(valid_moves):
+                self.engine.drop_piece(col, player_idx)
+                if i == 0:
+                    score = -self.negamax(depth - 1, -beta, -alpha, opponent_idx, -color)
+                else:
+                    score = -self.negamax(depth - 1, -alpha - 1, -alpha, opponent_idx, -color)
+                    if alpha < score < beta:
+                        score = -self.negamax(depth - 1, -beta, -alpha, opponent_idx, -color)
+                self.engine.undo_piece(col, player_idx)
+
+                if score > best_val:
+                    best_val = score
+                    best_col = col
+                    if score > alpha:
+                        alpha = score
+                        if alpha >= beta:
+                            self._record_cutoff(player_idx, col, allowed & self.engine.COLUMN_MASK[col], depth)
+                            if stats is not None: stats.beta_cutoffs[i] += 1
+                            break
 
         # 2. TT Store
         tt_flag = self.FLAG_EXACT
         if best_val <= alpha_orig: tt_flag = self.FLAG_UPPERBOUND
         elif best_val >= beta: tt_flag = self.FLAG_LOWERBOUND
 
-        self.transposition_table[state_key] = (best_val, depth, tt_flag)
-        return best_val
\ No newline at end of file
+        if mirrored and best_col >= 0: best_col = 6 - best_col
+        tt.store(state_key, best_val, depth, tt_flag, best_col)
+        return best_val
+
+    def _search_frontier(self, valid_moves, allowed, alpha, beta, player_idx, color):
+        """
+        Nodo a depth 1 con batch_frontier: tutti i figli sono valutati in una sola
+        chiamata evaluate_batch, poi il ciclo PVS procede in ordine come in negamax
+        (probe della TT sulle foglie, finestre nulle, cutoff, killer e history),
+        quindi il risultato è identico a quello seriale.
+        Restituisce (best_val, best_col).
+        """
+        engine = self.engine
+        stats = self._stats
+
+        # Figli come array uint64: solo la bitboard di chi muove cambia
+        column_mask = engine.COLUMN_MASK
+        moves = [allowed & column_mask[col] for col in valid_moves]
+        mover = np.array(moves, dtype=np.uint64) | np.uint64(engine.bitboards[player_idx])
+        other = np.full(len(moves), engine.bitboards[1 - player_idx], dtype=np.uint64)
+        if self._ai_idx == player_idx:
+            values = self.evaluator.evaluate_batch(mover, other)
+        else:
+            values = self.evaluator.evaluate_batch(other, mover)
+        # Valore del figlio dal punto di vista di chi muove nel figlio (come negamax a depth 0)
+        leaf_values = (-color * values).tolist()
+        if stats is not None:
+            stats.max_depth = max(stats.max_depth, engine.counter + 1 - self._root_ply)
+
+        # Chiave del figlio: position + mask, la cella entra in mask (e in bitboards[0] se muove 0)
+        base_key = engine.bitboards[0] + engine.mask
+        key_factor = 2 if player_idx == 0 else 1
+
+        best_val = float('-inf')
+        best_col = -1
+        for i, col in enumerate(valid_moves):
+            key = base_key + moves[i] * key_factor
+            if i == 0:
+                score = -self._frontier_leaf(key, -beta, -alpha, leaf_values[i])
+            else:
+                score = -self._frontier_leaf(key, -alpha - 1, -alpha, leaf_values[i])
+                if alpha < score < beta:
+                    score = -self._frontier_leaf(key, -beta, -alpha, leaf_values[i])
+
+            if score > best_val:
+                best_val = score
+                best_col = col
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        self._record_cutoff(player_idx, col, moves[i], 1)
+                        if stats is not None: stats.beta_cutoffs[i] += 1
+                        break
+        return best_val, best_col
+
+    def _frontier_leaf(self, key, alpha, beta, value):
+        """ negamax a depth 0 con il valore statico già calcolato dal batch. """
+        stats = self._stats
+        if stats is not None: stats.nodes += 1
+
+        tt = self.transposition_table
+        tt_idx = tt.probe(min(key, _mirror(key)) if self.mirror_tt else key)
+        if tt_idx >= 0:
+            tt_val = tt.values[tt_idx]
+            tt_flag = tt.flags[tt_idx]
+            if tt_flag == self.FLAG_EXACT:
+                if stats is not None: stats.tt_cutoffs += 1
+                return tt_val
+            elif tt_flag == self.FLAG_LOWERBOUND: alpha = max(alpha, tt_val)
+            elif tt_flag == self.FLAG_UPPERBOUND: beta = min(beta, tt_val)
+            if alpha >= beta:
+                if stats is not None: stats.tt_cutoffs += 1
+                return tt_val
+
+        if stats is not None: stats.leaf_evals += 1
+        return value
+
+    def _order_moves(self, mover, tt_move, allowed):
+        """
+        Ordina le mosse ammesse dalla maschera allowed: mossa della TT, poi killer
+        del ply corrente, poi il resto per history decrescente (a parità resta CENTER_ORDER).
+        allowed ha al più un bit per colonna, quello di atterraggio: la cella della
+        history si legge da lì, senza ricostruire le altezze.
+        """
+        column_mask = self.engine.COLUMN_MASK
+        moves = [c for c in self.CENTER_ORDER if allowed & column_mask[c]]
+        if len(moves) < 2: return moves
+
+        history = self.history[mover]
+        moves.sort(key=lambda c: history[(allowed & column_mask[c]).bit_length() - 1], reverse=True)
+
+        killer_1, killer_2 = self.killers[self.engine.counter]
+        for col in (killer_2, killer_1, tt_move):
+            if col >= 0 and col != moves[0] and col in moves:
+                moves.remove(col)
+                moves.insert(0, col)
+        return moves
+
+    def _clear_search_state(self):
+        """ Svuota TT, killer e history: nulla di quanto appreso vale per la nuova generazione. """
+        self.transposition_table.clear()
+        self.killers = [[-1, -1] for _ in range(43)]
+        self.history = [[0] * 49, [0] * 49]
+
+    def _record_cutoff(self, mover, col, move_bit, depth):
+        """ Aggiorna killer moves e history (cella = bit di atterraggio move_bit) dopo un beta cutoff. """
+        killers = self.killers[self.engine.counter]
+        if killers[0] != col:
+            killers[1] = killers[0]
+            killers[0] = col
+        self.history[mover][move_bit.bit_length() - 1] += depth * depth
+
+    # --- RICERCA PARALLELA (lato padre) ---
+
+    def _worker_generation(self):
+        """
+        Token della generazione: cambia quando la TT del padre viene svuotata
+        (es. a inizio partita), quando cambia l'evaluator o quando cambiano i suoi bias.
+        """
+        return self.transposition_table.generation, id(self.evaluator), self.evaluator.version
+
+    def _search_root_parallel(self, valid_moves, depth, player_idx):
+        """
+        Young Brothers Wait: la prima mossa (la più promettente) è cercata qui
+        mentre le altre sono già distribuite sui worker, che condividono il miglior
+        score trovato in una cella di memoria condivisa (i primi task partono
+        senza bound, i successivi con quello fissato dalle mosse già finite).
+        A parità di score vince la mossa che viene prima nell'ordinamento, come
+        nella ricerca seriale, qualunque sia l'ordine in cui finiscono i worker.
+        """
+        if self._pool is None:
+            self._shared_bound = multiprocessing.Value('d', float('-inf'))
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                             initargs=(self._shared_bound,))
+        self._shared_bound.value = float('-inf')
+
+        # L'evaluator viaggia solo finché tutti i worker non hanno la generazione corrente
+        generation = self._worker_generation()
+        if generation != self._generation:
+            self._generation = generation
+            self._payload = pickle.dumps(self.evaluator)
+            self._synced_workers = set()
+        payload = self._payload if len(self._synced_workers) < self.workers else None
+
+        state = self.engine.get_state()
+        token = id(self)
+        futures = [self._pool.submit(_search_root_move, token, generation, payload, state, col,
+                                     depth, player_idx, self.tt_size_mb, self._stats is not None,
+                                     self.batch_frontier)
+                   for col in valid_moves[1:]]
+
+        # Intanto il padre cerca la prima mossa a finestra piena e ne pubblica lo score
+        best_col, best_score = self._search_root(valid_moves[:1], depth, player_idx)
+        with self._shared_bound.get_lock():
+            if best_score > self._shared_bound.value:
+                self._shared_bound.value = best_score
+
+        # Risultati nell'ordine delle mosse: best_col è sempre la prima mossa col miglior score
+        opponent_idx = 1 - player_idx
+        for future in futures:
+            col, score, alpha_used, worker_stats, pid = future.result()
+            self._synced_workers.add(pid)
+            if worker_stats is not None: self._stats.merge(worker_stats)
+            # Solo i risultati sopra il bound usato sono esatti. score == alpha_used è un
+            # limite superiore che può nascondere un pareggio con la mossa che ha fissato
+            # il bound: se può ancora battere best_score la ricerchiamo qui.
+            if score <= alpha_used:
+                if score < alpha_used or alpha_used <= best_score: continue
+                self.engine.drop_piece(col, player_idx)
+                score = -self.negamax(depth - 1, float('-inf'), -best_score, opponent_idx, -1)
+                self.engine.undo_piece(col, player_idx)
+            if score > best_score:
+                best_score = score
+                best_col = col
+        return best_col, best_score
+
+    def close(self):
+        """ Chiude il pool di processi della ricerca parallela (se creato). """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+            self._shared_bound = None
+            self._generation = None
+            self._synced_workers = set()
@@ -2,10 +2,17 @@
 ai/opening_manager.py
 Gestisce l'apprendimento delle aperture utilizzando UCB1 per bilanciare
 sfruttamento (mosse forti) ed esplorazione (mosse poco testate).
+Gli stati sono salvati sotto la chiave canonica rispetto alla simmetria speculare.
+Il libro vive in una cache in memoria: il DB viene letto una volta all'avvio
+e aggiornato a blocchi (flush ogni FLUSH_EVERY partite e a fine sessione).
+In sola lettura (book_path) il libro è invece il file compilato da
+script/export_opening_book.py, mappato in memoria: nessun DB, nessun apprendimento.
 """
 import random
 import math
 
+from src.ai.book_file import BinaryOpeningBook
+
 class OpeningManager:
     # --- CONFIGURAZIONE RICOMPENSE ---
     REWARD_WIN = 100
@@ -16,33 +23,60 @@ class OpeningManager:
     # Costante di esplorazione per UCB1 (più alta = più curiosità)
     EXPLORATION_C = 1.41
 
-    def __init__(self, persistence):
+    # Ogni quante partite concluse gli aggiornamenti in memoria vengono scritti nel DB
+    FLUSH_EVERY = 50
+
+    # Aumentiamo la profondità: ora impariamo fino a metà partita
+    MAX_BOOK_DEPTH = 10
+
+    def __init__(self, persistence, book_path=None):
+        """
+        persistence: GamePersistence da cui caricare e su cui salvare il libro.
+        book_path: file compilato da aprire in sola lettura (persistence può essere None).
+        """
         self.persistence = persistence
         self.game_history = []
-        # Aumentiamo la profondità: ora impariamo fino a metà partita
-        self.MAX_BOOK_DEPTH = 10
-
-    def record_move(self, engine, move, player_who_moved):
-        """ Registra la mossa corrente per il backpropagation a fine partita """
-        if engine.counter > self.MAX_BOOK_DEPTH: return
+        self.read_only = book_path is not None
+
+        # Cache del libro, caricata una volta: state_key -> {move_col: [visits, total_score]}.
+        # Letture e aggiornamenti avvengono qui; il DB riceve i delta (write-behind).
+        self.book = {}
+        self.binary_book = None
+        if self.read_only:
+            self.binary_book = BinaryOpeningBook(book_path)
+        else:
+            for state_key, move_col, visits, total_score in persistence.load_opening_book():
+                self.book.setdefault(state_key, {})[move_col] = [visits, total_score]
+        # Delta non ancora scritti: (state_key, move_col) -> [visits, total_score]
+        self.dirty = {}
+        self.games_since_flush = 0
+
+    def record_move(self, engine, move, player_who_moved, history=None):
+        """
+        Registra la mossa corrente per il backpropagation a fine partita.
+        history: lista della partita (default game_history), per giocarne più insieme.
+        """
+        if self.read_only or engine.counter > self.MAX_BOOK_DEPTH: return
+        if history is None: history = self.game_history
 
-        p1 = engine.bitboards[0]
-        p2 = engine.bitboards[1]
-        state_hash = f"{p1}_{p2}"
+        # Posizione e riflesso condividono le statistiche: salviamo sotto la
+        # chiave canonica, con la mossa riflessa se la posizione è quella speculare.
+        key, mirrored = engine.get_canonical_key()
 
-        self.game_history.append({
-            "state": state_hash,
-            "move": move,
+        history.append({
+            "state": key,
+            "move": 6 - move if mirrored else move,
             "player": player_who_moved
         })
 
-    def finalize_game(self, winner_player_idx):
+    def finalize_game(self, winner_player_idx, history=None):
         """ Assegna i premi/punizioni a tutte le mosse registrate """
-        if not self.game_history: return
+        if history is None: history = self.game_history
+        if self.read_only or not history: return
 
-        # print(f"[BOOK] Apprendimento su {len(self.game_history)} mosse...")
+        # print(f"[BOOK] Apprendimento su {len(history)} mosse...")
 
-        for record in self.game_history:
+        for record in history:
             state = record["state"]
             move = record["move"]
             mover = record["player"]
@@ -55,21 +89,55 @@ class OpeningManager:
             else:
                 score = self.REWARD_LOSS
 
-            # Scriviamo nel DB (Update incrementale)
-            self.persistence.update_opening_move(state, move, score)
+            # Aggiornamento in memoria; il DB lo riceve al prossimo flush
+            entry = self.book.setdefault(state, {}).setdefault(move, [0, 0])
+            entry[0] += 1
+            entry[1] += score
+            delta = self.dirty.setdefault((state, move), [0, 0])
+            delta[0] += 1
+            delta[1] += score
+
+        history.clear()
+
+        self.games_since_flush += 1
+        if self.games_since_flush >= self.FLUSH_EVERY:
+            self.flush()
 
-        self.game_history.clear()
+    def flush(self):
+        """
+        Scrive nel DB tutti i delta accumulati, in un'unica transazione.
+        Va chiamato anche a fine sessione, per non perdere le ultime partite.
+        """
+        if self.read_only: return
+        if self.dirty:
+            self.persistence.apply_opening_deltas(
+                [(state, move, visits, score) for (state, move), (visits, score) in self.dirty.items()])
+            self.dirty.clear()
+        self.games_since_flush = 0
+
+    def close(self):
+        """ Rilascia il file compilato (solo in sola lettura). """
+        if self.binary_book is not None:
+            self.binary_book.close()
+            self.binary_book = None
 
     def get_best_move(self, engine):
         """
         Sceglie la mossa migliore usando l'algoritmo UCB1.
         Restituisce: (move, True) se trovata, (None, False) se non ci sono dati.
         """
-        p1, p2 = engine.bitboards[0], engine.bitboards[1]
-        state_hash = f"{p1}_{p2}"
-
-        # Recuperiamo stats: [(move, visits, total_score), ...]
-        stats = self.persistence.get_opening_stats(state_hash)
+        if self.read_only:
+            # Oltre la profondità compilata il file non ha stati: niente lookup
+            if engine.counter > self.binary_book.max_depth: return None, False
+            key, mirrored = engine.get_canonical_key()
+            stats = self.binary_book.lookup(key)
+        else:
+            key, mirrored = engine.get_canonical_key()
+
+            # Recuperiamo stats dalla cache: [(move, visits, total_score), ...] in ordine di colonna
+            moves = self.book.get(key)
+            stats = [(move, visits, total_score) for move, (visits, total_score) in sorted(moves.items())] \
+                if moves else []
 
         # Se non abbiamo mai visto questo stato, lasciamo fare al Minimax
         if not stats: return None, False
@@ -121,4 +189,6 @@ class OpeningManager:
                return None, False
 
         # print(f"[BOOK] Mossa UCB scelta: {best_move+1} (Score: {best_ucb_score:.2f})")
+        # Le mosse del libro sono nel verso canonico: riportiamole sulla scacchiera reale
+        if mirrored: best_move = 6 - best_move
         return best_move, True
\ No newline at end of file
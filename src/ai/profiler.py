@@ -5,10 +5,20 @@ Corregge il bug delle "Minacce Volanti".
 Il bias aumenta SOLO se il bot ignora una minaccia che era FISICAMENTE GIOCABILE (playable_mask).
 Questo impedirà al bias orizzontale di salire ingiustamente.
 """
-from src.ai.analysis import get_threat_mask
+import itertools
+
+from src.ai.analysis import scan_patterns
+
+# Numeri di versione globali: restano univoci anche se il profiler viene re-inizializzato
+_versions = itertools.count(1)
+
 
 class OpponentProfiler:
     def __init__(self):
+        # Cambia a ogni modifica dei bias: gli evaluator la usano per sapere
+        # quando ricalcolare i coefficienti precompilati.
+        self.version = next(_versions)
+
         self.biases = {
             "missed_win": 1.0,
             "vertical_weakness": 1.0,
@@ -43,6 +53,12 @@ class OpponentProfiler:
         smoothed_delta = delta * self.SMOOTHING
         new_value = self.biases[key] + smoothed_delta
         self.biases[key] = max(MIN_VAL, min(new_value, self.LIMIT))
+        self.version = next(_versions)
+
+    def set_biases(self, biases):
+        """ Carica un profilo salvato (es. dal DB) e invalida gli snapshot degli evaluator. """
+        self.biases.update(biases)
+        self.version = next(_versions)
 
     def cooling_after_loss(self):
         applied = False
@@ -52,6 +68,7 @@ class OpponentProfiler:
                 excess = self.biases[k] - 1.0
                 self.biases[k] = 1.0 + (excess * (1 - COOLING_FACTOR))
                 applied = True
+                self.version = next(_versions)
                 #print(f"[PROFILER] Bias '{k}' punito (era > {self.ARROGANCE_THRESHOLD})")
         #if not applied:
             #print(f"[PROFILER] Nessun bias sopra {self.ARROGANCE_THRESHOLD}.")
@@ -71,9 +88,16 @@ class OpponentProfiler:
         opp_pieces = state_before[opponent_idx] # Bot
         my_pieces = state_before[(opponent_idx + 1) % 2] # IA
 
+        # Un solo passaggio sui pattern di entrambi i giocatori
+        my_scan, opp_scan = scan_patterns(my_pieces, opp_pieces, ~(my_pieces | opp_pieces))
+
         # 1. KILLER INSTINCT (Lethal)
         # Se l'avversario aveva una mossa vincente e non l'ha giocata.
-        winning_spots = get_threat_mask(opp_pieces, opp_pieces | my_pieces) & playable_mask
+        # (Le minacce verticali "sotto" un tris non sono mai giocabili: playable_mask le esclude.)
+        winning_spots = 0
+        for _, _, trio_ends, gap_threats in opp_scan:
+            winning_spots |= trio_ends | gap_threats
+        winning_spots &= playable_mask
         if winning_spots > 0 and (winning_spots & played_bit) == 0:
             self._apply_bias("missed_win", self.RATES["lethal"])
             # Se manca una vittoria, aumenta drasticamente anche la sottovalutazione generale delle minacce.
@@ -82,19 +106,20 @@ class OpponentProfiler:
 
         # 2. ANALISI STRATEGICA DIFFERENZIALE
         # Passiamo playable_mask per ignorare le minacce "volanti" (irraggiungibili)
-        self._analyze_response(my_pieces, played_bit, playable_mask)
+        self._analyze_response(my_pieces, my_scan, played_bit, playable_mask)
 
-    def _analyze_response(self, my_pieces, played_bit, playable_mask):
+    def _analyze_response(self, my_pieces, my_scan, played_bit, playable_mask):
         """
         Analizza se la mossa giocata blocca una minaccia o la ignora.
         Considera SOLO le minacce che erano effettivamente giocabili (playable_mask).
+        my_scan: pattern dell'IA prodotti da scan_patterns (ordine di DIRECTIONS).
         """
         # --- VERTICALE ---
         if (played_bit >> 1) & my_pieces and (played_bit >> 2) & my_pieces:
             self._apply_bias("vertical_weakness", -self.RATES["correction"])
 
         # --- ORIZZONTALE ---
-        h_threats = self._get_potential_threats(my_pieces, 7)
+        h_threats = self._get_potential_threats(my_scan[1], 7)
         if h_threats & played_bit:
             self._apply_bias("horizontal_weakness", -self.RATES["correction"])
         elif (h_threats & playable_mask):
@@ -103,7 +128,7 @@ class OpponentProfiler:
             self._apply_bias("threat_underestimation", self.RATES["strategic"] * 0.3)
 
         # --- DIAGONALI ---
-        d_threats = self._get_potential_threats(my_pieces, 6) | self._get_potential_threats(my_pieces, 8)
+        d_threats = self._get_potential_threats(my_scan[2], 6) | self._get_potential_threats(my_scan[3], 8)
         if d_threats & played_bit:
             self._apply_bias("diagonal_weakness", -self.RATES["correction"])
         elif (d_threats & playable_mask):
@@ -111,23 +136,19 @@ class OpponentProfiler:
             self._apply_bias("diagonal_weakness", self.RATES["strategic"] * 1.5)
             self._apply_bias("threat_underestimation", self.RATES["strategic"] * 0.5)
 
-    def _get_potential_threats(self, pieces, shift):
+    def _get_potential_threats(self, patterns, shift):
         """
         Genera una maschera bitwise per rilevare coppie o tris che creano minacce immediate.
+        patterns: voce (pairs, splits, ...) di scan_patterns per questa direzione.
         """
-        # Sposta a destra (controlla sinistra)
-        shifted_right = pieces >> shift
-        pairs_right = pieces & shifted_right
-        threats_left = pairs_right >> shift
+        pairs, splits = patterns[0], patterns[1]
 
-        # Sposta a sinistra (controlla destra)
-        shifted_left = pieces << shift
-        pairs_left = pieces & shifted_left
-        threats_right = pairs_left << shift
+        # Coppia XX: casella prima (_XX) e dopo (XX_)
+        threats_left = pairs >> shift
+        threats_right = pairs << (shift * 2)
 
         # Pattern Gap: X_X
-        gap_base = pieces & (pieces >> (shift * 2))
-        threats_gap = gap_base << shift
+        threats_gap = splits << shift
 
         return threats_left | threats_right | threats_gap
 
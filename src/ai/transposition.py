@@ -0,0 +1,104 @@
+"""
+ai/transposition.py
+Transposition Table a capacità fissa per il Minimax.
+- Memoria preallocata (array) dimensionata in MB: non cresce durante la sessione.
+- Indirizzamento aperto a due bucket per slot:
+  [0] depth-preferred (tiene la ricerca più profonda), [1] always-replace.
+- Contatori di probe/hit/collisioni per misurare l'efficacia della cache
+  (probe/hit opzionali: con counters=False il probe non li aggiorna).
+- Ogni entry conserva anche la mossa migliore (o del cutoff) per l'ordinamento.
+"""
+from array import array
+
+
+class TranspositionTable:
+    FLAG_EXACT = 0
+    FLAG_LOWERBOUND = 1
+    FLAG_UPPERBOUND = 2
+
+    # Byte per entry: key (Q) + value (d) + depth (b) + flag (b) + move (b)
+    ENTRY_BYTES = 8 + 8 + 1 + 1 + 1
+
+    def __init__(self, size_mb=16, counters=True):
+        self.size_mb = size_mb
+        # Ogni slot contiene due bucket adiacenti: indice 2*slot e 2*slot + 1
+        self.n_slots = max(1, int(size_mb * 1024 * 1024) // (self.ENTRY_BYTES * 2))
+        self.capacity = self.n_slots * 2
+        # Incrementata a ogni clear(): chi tiene copie derivate (i worker paralleli) sa quando scartarle
+        self.generation = 0
+        self.clear()
+        # Senza contatori il probe dell'istanza è la versione che non li tocca:
+        # nessun costo per chi non legge probes/hits (es. Minimax senza statistiche)
+        if not counters: self.probe = self._probe_uncounted
+
+    def clear(self):
+        """ Svuota la tabella (depth = -1 marca un bucket vuoto) e azzera i contatori. """
+        self.generation += 1
+        self.keys = array('Q', bytes(8 * self.capacity))
+        self.values = array('d', bytes(8 * self.capacity))
+        self.depths = array('b', [-1]) * self.capacity
+        self.flags = array('b', bytes(self.capacity))
+        self.moves = array('b', [-1]) * self.capacity
+
+        self.probes = 0
+        self.hits = 0
+        self.collisions = 0
+
+    def probe(self, key):
+        """
+        Cerca la posizione nei due bucket del suo slot.
+        Restituisce l'indice dell'entry (da leggere in values/depths/flags/moves) o -1.
+        Nessuna tupla viene allocata.
+        """
+        self.probes += 1
+        keys = self.keys
+        i = (key % self.n_slots) << 1
+        if keys[i] == key and self.depths[i] >= 0:
+            self.hits += 1
+            return i
+        i += 1
+        if keys[i] == key and self.depths[i] >= 0:
+            self.hits += 1
+            return i
+        return -1
+
+    def _probe_uncounted(self, key):
+        """ probe senza aggiornare probes/hits. """
+        keys = self.keys
+        i = (key % self.n_slots) << 1
+        if keys[i] == key and self.depths[i] >= 0: return i
+        i += 1
+        if keys[i] == key and self.depths[i] >= 0: return i
+        return -1
+
+    def store(self, key, value, depth, flag, move=-1):
+        """
+        Salva un risultato di ricerca.
+        Il bucket depth-preferred viene sovrascritto solo da una ricerca almeno
+        altrettanto profonda (o dalla stessa posizione); altrimenti si usa
+        il bucket always-replace. Una chiave occupa al massimo un bucket.
+        """
+        keys = self.keys
+        depths = self.depths
+        i = (key % self.n_slots) << 1
+        old_depth = depths[i]
+
+        if old_depth >= 0 and keys[i] != key:
+            if depth < old_depth:
+                # Bucket principale più profondo: ripieghiamo sull'always-replace
+                i += 1
+                if depths[i] >= 0 and keys[i] != key:
+                    self.collisions += 1
+            else:
+                self.collisions += 1
+                if keys[i + 1] == key:
+                    depths[i + 1] = -1
+
+        keys[i] = key
+        self.values[i] = value
+        depths[i] = depth
+        self.flags[i] = flag
+        self.moves[i] = move
+
+    def hit_rate(self):
+        return self.hits / self.probes if self.probes else 0.0
@@ -0,0 +1,165 @@
+"""
+ai/windows.py
+Le 69 finestre vincenti del Forza 4 e il loro conteggio incrementale.
+- Tabelle precalcolate cella -> finestre (per giocatore e posizione nella finestra).
+- WindowTracker: occupazione di ogni finestra (4 bit per giocatore) e un unico
+  accumulatore intero con tutti i contatori impacchettati in campi a larghezza fissa.
+  drop/undo lo aggiornano a delta (una somma per finestra toccata), la foglia lo legge in O(1).
+"""
+
+# Gruppi di direzione (stesso raggruppamento dei pesi di AdaptiveEvaluator)
+GROUP_VERTICAL = 0
+GROUP_HORIZONTAL = 1
+GROUP_DIAGONAL = 2
+
+# --- LAYOUT DELL'ACCUMULATORE ---
+# Campi da 16 bit per giocatore: coppie e tris "vivi" (finestra senza pezzi
+# avversari) per gruppo di direzione, più le finestre complete (vittoria).
+FIELD_BITS = 16
+FIELD_MASK = (1 << FIELD_BITS) - 1
+FIELD_TWO = 0      # + gruppo
+FIELD_THREE = 3    # + gruppo
+FIELD_FOUR = 6
+FIELDS_PER_PLAYER = 7
+PLAYER_BITS = FIELDS_PER_PLAYER * FIELD_BITS
+FEATURE_BITS = 2 * PLAYER_BITS
+
+# Campi da 8 bit per cella (indice di bit della bitboard, guardiani compresi):
+# quante finestre "da tre" hanno quella cella come casella mancante.
+# Un campo non nullo = cella minacciata; al massimo 13 finestre per cella, niente riporti.
+CELL_BITS = 8
+N_CELLS = 49
+THREAT_BITS = N_CELLS * CELL_BITS
+THREAT_MASK = (1 << THREAT_BITS) - 1
+_THREAT_LOW = sum(0x7F << (cell * CELL_BITS) for cell in range(N_CELLS))
+_THREAT_HIGH = sum(0x80 << (cell * CELL_BITS) for cell in range(N_CELLS))
+
+
+def _build_windows():
+    """ Le 69 finestre come (gruppo, 4 indici di cella col * 7 + row). """
+    windows = []
+    for col in range(7):
+        for row in range(3):
+            windows.append((GROUP_VERTICAL, tuple(col * 7 + row + k for k in range(4))))
+    for col in range(4):
+        for row in range(6):
+            windows.append((GROUP_HORIZONTAL, tuple((col + k) * 7 + row for k in range(4))))
+    for col in range(4):
+        for row in range(3):
+            windows.append((GROUP_DIAGONAL, tuple((col + k) * 7 + row + k for k in range(4))))
+        for row in range(3, 6):
+            windows.append((GROUP_DIAGONAL, tuple((col + k) * 7 + row - k for k in range(4))))
+    return windows
+
+
+WINDOWS = _build_windows()
+
+
+def _window_value(group, cells, code):
+    """
+    Contributo impacchettato di una finestra nello stato code
+    (bit 0-3: pezzi del giocatore 0, bit 4-7: pezzi del giocatore 1).
+    """
+    value = 0
+    for player in (0, 1):
+        mine = (code >> (4 * player)) & 0xF
+        if not mine or (code >> (4 * (1 - player))) & 0xF:
+            continue
+        base = player * PLAYER_BITS
+        count = mine.bit_count()
+        if count == 2:
+            value += 1 << (base + (FIELD_TWO + group) * FIELD_BITS)
+        elif count == 3:
+            value += 1 << (base + (FIELD_THREE + group) * FIELD_BITS)
+            empty_cell = cells[(~mine & 0xF).bit_length() - 1]
+            value += 1 << (FEATURE_BITS + player * THREAT_BITS + empty_cell * CELL_BITS)
+        elif count == 4:
+            value += 1 << (base + FIELD_FOUR * FIELD_BITS)
+    return value
+
+
+def _build_tables():
+    """
+    DELTAS[(w * 8 + step) * 256 + code]: variazione dell'accumulatore quando la
+    finestra w passa da code a code | (1 << step). step = posizione + 4 * giocatore.
+    CELL_STEPS[player][cell]: tuple (w, bit, base) delle finestre che contengono la cella.
+    """
+    deltas = [0] * (len(WINDOWS) * 8 * 256)
+    cell_steps = [[[] for _ in range(N_CELLS)] for _ in range(2)]
+    for w, (group, cells) in enumerate(WINDOWS):
+        values = [_window_value(group, cells, code) for code in range(256)]
+        for pos, cell in enumerate(cells):
+            for player in (0, 1):
+                step = pos + 4 * player
+                bit = 1 << step
+                base = (w * 8 + step) * 256
+                cell_steps[player][cell].append((w, bit, base))
+                for code in range(256):
+                    if not code & bit:
+                        deltas[base + code] = values[code | bit] - values[code]
+    return deltas, [[tuple(steps) for steps in per_player] for per_player in cell_steps]
+
+
+_DELTAS, CELL_STEPS = _build_tables()
+
+
+def player_counts(acc, player_idx):
+    """
+    Contatori del giocatore, nell'ordine dei campi:
+    (two_v, two_h, two_d, three_v, three_h, three_d, four).
+    """
+    f = (acc >> (player_idx * PLAYER_BITS)) & ((1 << PLAYER_BITS) - 1)
+    return (f & FIELD_MASK, (f >> 16) & FIELD_MASK, (f >> 32) & FIELD_MASK,
+            (f >> 48) & FIELD_MASK, (f >> 64) & FIELD_MASK, (f >> 80) & FIELD_MASK,
+            f >> 96)
+
+
+def threat_cells(acc, player_idx):
+    """ Numero di celle distinte che completerebbero un 4-in-fila per il giocatore. """
+    fields = (acc >> (FEATURE_BITS + player_idx * THREAT_BITS)) & THREAT_MASK
+    return ((fields + _THREAT_LOW) & _THREAT_HIGH).bit_count()
+
+
+class WindowTracker:
+    """
+    Stato incrementale delle 69 finestre di un GameEngine.
+    Si aggancia all'engine (engine.tracker), che lo notifica a ogni
+    drop_piece/undo_piece e lo ricostruisce su set_state/reset.
+    """
+
+    def __init__(self, engine):
+        self.codes = [0] * len(WINDOWS)
+        self.acc = 0
+        self.rebuild(engine)
+        engine.tracker = self
+
+    def rebuild(self, engine):
+        """ Ricalcola tutto dalle bitboard (O(pezzi), fuori dal ciclo di ricerca). """
+        self.codes = [0] * len(WINDOWS)
+        self.acc = 0
+        for player_idx in (0, 1):
+            b = engine.bitboards[player_idx]
+            while b:
+                low = b & -b
+                self.on_drop(low.bit_length() - 1, player_idx)
+                b ^= low
+
+    def on_drop(self, cell, player_idx):
+        codes = self.codes
+        deltas = _DELTAS
+        acc = self.acc
+        for w, bit, base in CELL_STEPS[player_idx][cell]:
+            code = codes[w]
+            codes[w] = code | bit
+            acc += deltas[base + code]
+        self.acc = acc
+
+    def on_undo(self, cell, player_idx):
+        codes = self.codes
+        deltas = _DELTAS
+        acc = self.acc
+        for w, bit, base in CELL_STEPS[player_idx][cell]:
+            code = codes[w] ^ bit
+            codes[w] = code
+            acc -= deltas[base + code]
+        self.acc = acc
@@ -0,0 +1,75 @@
+import numpy as np
+
+from src.ai.analysis import has_four
+from src.board.engine import GameEngine
+
+
+class BatchGameEngine:
+    """
+    N partite in parallelo, stesso layout bitboard di GameEngine
+    (7 bit per colonna, bit = col * 7 + row) ma su array NumPy uint64.
+    - position: pedine del giocatore 0; quelle del giocatore 1 sono position ^ mask.
+    - heights[i, col]: indice del bit della prima cella libera (come GameEngine.heights).
+    - done/winner: partita conclusa e vincitore (0, 1, oppure -1 = pareggio / in corso).
+    Ogni drop applica una mossa per scacchiera e rileva vittorie e pareggi
+    con gli stessi shift-and di _check_bitboard_victory, su tutte le scacchiere insieme.
+    """
+
+    COLUMN_BASE = np.arange(7, dtype=np.int64) * 7
+    TOP_LIMIT = COLUMN_BASE + 6
+    COLUMN_MASK = np.array(GameEngine.COLUMN_MASK, dtype=np.uint64)
+
+    def __init__(self, n_boards):
+        self.n_boards = n_boards
+        self.reset()
+
+    def reset(self):
+        """ Tutte le scacchiere vuote. """
+        n = self.n_boards
+        self.position = np.zeros(n, dtype=np.uint64)
+        self.mask = np.zeros(n, dtype=np.uint64)
+        self.heights = np.tile(self.COLUMN_BASE, (n, 1))
+        self.counter = np.zeros(n, dtype=np.int64)
+        self.done = np.zeros(n, dtype=bool)
+        self.winner = np.full(n, -1, dtype=np.int8)
+
+    def bitboards(self, player_idx):
+        """ Array delle pedine del giocatore su tutte le scacchiere. """
+        if player_idx == 0: return self.position
+        return self.position ^ self.mask
+
+    def valid_moves(self):
+        """ Matrice booleana (n, 7): colonne non piene. """
+        return self.heights < self.TOP_LIMIT
+
+    def drop(self, boards, cols, players):
+        """
+        Una mossa per ciascuna scacchiera indicata: boards, cols e players sono
+        array allineati (players può essere anche un intero). Le mosse devono essere legali.
+        Aggiorna done/winner: vittoria di chi ha mosso o scacchiera piena.
+        """
+        boards = np.asarray(boards, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        players = np.broadcast_to(np.asarray(players, dtype=np.int64), boards.shape)
+
+        move = np.left_shift(np.uint64(1), self.heights[boards, cols].astype(np.uint64))
+        self.mask[boards] |= move
+        self.position[boards] |= np.where(players == 0, move, np.uint64(0))
+        self.heights[boards, cols] += 1
+        self.counter[boards] += 1
+
+        mover_pieces = np.where(players == 0, self.position[boards], self.position[boards] ^ self.mask[boards])
+        won = self.has_four(mover_pieces)
+        self.winner[boards] = np.where(won, players, -1)
+        self.done[boards] = won | (self.counter[boards] >= 42)
+
+    # Array booleano: quali bitboard contengono un 4-in-fila (kernel condiviso di analysis)
+    has_four = staticmethod(has_four)
+
+    # --- PONTE VERSO GameEngine ---
+
+    def get_state(self, i):
+        """ Stato della scacchiera i nel formato di GameEngine.get_state(). """
+        b0 = int(self.position[i])
+        b1 = b0 ^ int(self.mask[i])
+        return [b0, b1, self.heights[i].tolist(), int(self.counter[i])]
@@ -7,27 +7,155 @@ class GameEngine:
     # Corrisponde a: 1000000 1000000 1000000 1000000 1000000 1000000 1000000
     TOP_MASK = 0b1000000100000010000001000000100000010000001000000
 
+    # --- MASCHERE POSITION/MASK (per colonna) ---
+    # BOTTOM: bit della riga 0. COLUMN: le 6 celle giocabili. TOP_CELL: la riga 5.
+    BOTTOM_MASK = [1 << (col * 7) for col in range(7)]
+    COLUMN_MASK = [0b111111 << (col * 7) for col in range(7)]
+    TOP_CELL_MASK = [1 << (col * 7 + 5) for col in range(7)]
+    # Riga 0 di tutte le colonne e tutte le 42 celle giocabili (senza guardiani)
+    BOTTOM_ROW = sum(BOTTOM_MASK)
+    BOARD_MASK = BOTTOM_ROW * 0b111111
+    # Colonne intere a 7 bit (guardiano compreso), per la riflessione sinistra-destra
+    FULL_COLUMN_MASK = [0b1111111 << (col * 7) for col in range(7)]
+    # Una cella della colonna col finisce nella colonna 6 - col: shift a sinistra o a destra
+    MIRROR_LEFT = [max(0, (6 - 2 * col) * 7) for col in range(7)]
+    MIRROR_RIGHT = [max(0, (2 * col - 6) * 7) for col in range(7)]
+
     def __init__(self):
         self.bitboards = [0, 0]  # [Player 0 (Giallo), Player 1 (Rosso)]
-        # Altezze iniziali: puntano alla riga 0 di ogni colonna (0, 7, 14, 21...)
-        self.heights = [col * 7 for col in range(7)]
+        # Tutte le pedine sulla scacchiera (bitboards[0] | bitboards[1]).
+        # Le altezze delle colonne si ricavano da qui, non servono liste separate.
+        self.mask = 0
         self.counter = 0
+        # mirror(get_key()) aggiornata a ogni mossa: chiave canonica senza ricalcolare la riflessione
+        self.mirrored_key = 0
+        # Osservatore opzionale (es. WindowTracker): notificato su drop/undo,
+        # ricostruito su set_state/reset. None = nessun aggiornamento.
+        self.tracker = None
+
+    @property
+    def heights(self):
+        """
+        Altezze derivate dalla mask: indice del bit della prima cella libera
+        di ogni colonna (0, 7, 14, 21... a scacchiera vuota).
+        """
+        return [col * 7 + (self.mask & self.COLUMN_MASK[col]).bit_count() for col in range(7)]
 
     def is_valid_location(self, col):
         """
-        Controlla se la colonna non è piena.
-        Verifica se il bit puntato da heights[col] colliderebbe con la TOP_MASK.
+        Controlla se la colonna non è piena (cella della riga 5 ancora libera).
         """
-        return ((1 << self.heights[col]) & self.TOP_MASK) == 0
+        return (self.mask & self.TOP_CELL_MASK[col]) == 0
 
     def drop_piece(self, col, player_idx):
         """
-        Inserisce la pedina nella colonna e aggiorna l'altezza.
+        Inserisce la pedina nella colonna: la cella è (mask + bottom) & column.
         """
-        move = 1 << self.heights[col]
-        self.bitboards[player_idx] ^= move  # XOR per attivare il bit
-        self.heights[col] += 1
+        move = (self.mask + self.BOTTOM_MASK[col]) & self.COLUMN_MASK[col]
+        self.bitboards[player_idx] |= move
+        self.mask |= move
         self.counter += 1
+        # Nella chiave position + mask la cella vale 2 per il giocatore 0, 1 per il giocatore 1
+        self.mirrored_key += (move << self.MIRROR_LEFT[col] >> self.MIRROR_RIGHT[col]) << (1 - player_idx)
+        if self.tracker is not None:
+            self.tracker.on_drop(move.bit_length() - 1, player_idx)
+
+    def undo_piece(self, col, player_idx):
+        """
+        Annulla l'ultima pedina inserita nella colonna (inverso di drop_piece).
+        O(1) e senza allocazioni: usato dal Minimax al posto di get_state/set_state.
+        """
+        column = self.mask & self.COLUMN_MASK[col]
+        move = column & ~(column >> 1)  # Bit più alto della colonna
+        self.bitboards[player_idx] ^= move
+        self.mask ^= move
+        self.counter -= 1
+        self.mirrored_key -= (move << self.MIRROR_LEFT[col] >> self.MIRROR_RIGHT[col]) << (1 - player_idx)
+        if self.tracker is not None:
+            self.tracker.on_undo(move.bit_length() - 1, player_idx)
+
+    def get_key(self):
+        """
+        Chiave intera univoca della posizione (position + mask).
+        La somma non genera riporti tra colonne, quindi ogni coppia di
+        bitboard produce un intero diverso: usata da TT e Opening Book.
+        """
+        return self.bitboards[0] + self.mask
+
+    # --- SIMMETRIA SPECCHIO ---
+
+    @staticmethod
+    def mirror(b):
+        """
+        Riflessione sinistra-destra (colonna c -> 6 - c) di una bitboard o di una
+        chiave position + mask: le colonne sono blocchi di 7 bit senza riporti
+        tra loro, quindi bastano una maschera e uno shift per colonna.
+        """
+        m = GameEngine.FULL_COLUMN_MASK
+        return (((b & m[0]) << 42) | ((b & m[1]) << 28) | ((b & m[2]) << 14) | (b & m[3]) |
+                ((b & m[4]) >> 14) | ((b & m[5]) >> 28) | ((b & m[6]) >> 42))
+
+    @staticmethod
+    def canonical_key(key):
+        """
+        Chiave canonica di una posizione e della sua immagine speculare (la minore delle due).
+        Restituisce (chiave, mirrored): con mirrored True le colonne vanno riflesse (6 - col)
+        per passare dalla posizione reale a quella canonica e viceversa.
+        """
+        mirrored = GameEngine.mirror(key)
+        if mirrored < key: return mirrored, True
+        return key, False
+
+    def get_canonical_key(self):
+        """ canonical_key della posizione corrente, usando la chiave speculare già aggiornata. """
+        key = self.bitboards[0] + self.mask
+        if self.mirrored_key < key: return self.mirrored_key, True
+        return key, False
+
+    # --- MOSSE FORZATE (solo operazioni bitwise) ---
+
+    def possible_moves_mask(self):
+        """ Celle giocabili adesso: la prima cella libera di ogni colonna non piena. """
+        return (self.mask + self.BOTTOM_ROW) & self.BOARD_MASK
+
+    def winning_cells(self, player_idx):
+        """
+        Tutte le celle VUOTE (anche non ancora raggiungibili) che completerebbero
+        un 4-in-fila per il giocatore.
+        """
+        return self._compute_winning_cells(self.bitboards[player_idx]) & (self.BOARD_MASK ^ self.mask)
+
+    def non_losing_moves(self, player_idx):
+        """
+        Maschera delle mosse che non perdono subito:
+        - con una minaccia avversaria giocabile, l'unica mossa è bloccarla;
+        - con due o più minacce giocabili non c'è difesa (restituisce 0);
+        - si scartano le mosse che giocano SOTTO una cella vincente avversaria.
+        Va usata dopo aver escluso una vittoria immediata di player_idx.
+        """
+        possible = self.possible_moves_mask()
+        opp_win = self.winning_cells(1 - player_idx)
+        forced = possible & opp_win
+        if forced:
+            if forced & (forced - 1): return 0
+            possible = forced
+        return possible & ~(opp_win >> 1)
+
+    @staticmethod
+    def _compute_winning_cells(b):
+        """ Celle che completano XXX_, _XXX, XX_X, X_XX in ogni direzione. """
+        # Verticale: solo tre pedine sotto la cella
+        r = (b << 1) & (b << 2) & (b << 3)
+
+        # Orizzontale (7), Diagonale \ (6), Diagonale / (8)
+        for shift in (7, 6, 8):
+            p = (b << shift) & (b << (shift * 2))
+            r |= p & (b << (shift * 3))
+            r |= p & (b >> shift)
+            p = (b >> shift) & (b >> (shift * 2))
+            r |= p & (b << shift)
+            r |= p & (b >> (shift * 3))
+        return r
 
     def is_winning_move(self, col, player_idx):
         """
@@ -35,7 +163,8 @@ class GameEngine:
         Fondamentale per il Minimax (Killer Instinct) e il Profiler.
         """
         # Creiamo una bitboard temporanea con la mossa aggiunta
-        temp_bitboard = self.bitboards[player_idx] | (1 << self.heights[col])
+        move = (self.mask + self.BOTTOM_MASK[col]) & self.COLUMN_MASK[col]
+        temp_bitboard = self.bitboards[player_idx] | move
         return self._check_bitboard_victory(temp_bitboard)
 
     def check_victory(self, player_idx):
@@ -92,8 +221,8 @@ class GameEngine:
         IMPORTANTE: Deve includere le Bitboard E le Altezze (heights).
         Il Profiler si aspetta: [bitboard_P1, bitboard_P2, heights_list]
         """
-        # Restituiamo una copia delle bitboard e una COPIA delle altezze (heights[:])
-        return [self.bitboards[0], self.bitboards[1], self.heights[:], self.counter]
+        # Le altezze sono ricavate dalla mask: la lista è già una copia
+        return [self.bitboards[0], self.bitboards[1], self.heights, self.counter]
 
     def set_state(self, state):
         """
@@ -102,14 +231,19 @@ class GameEngine:
         self.bitboards[0] = state[0]
         self.bitboards[1] = state[1]
 
-        # Ripristiniamo anche le altezze.
-        # Se il tuo vecchio codice non passava le heights, questo crashava.
-        self.heights = state[2][:]
+        # Le altezze (state[2]) non vanno ripristinate: derivano dalla mask.
+        self.mask = state[0] | state[1]
         self.counter = state[3]
+        self.mirrored_key = self.mirror(state[0] + self.mask)
+        if self.tracker is not None:
+            self.tracker.rebuild(self)
 
 
     def reset(self):
         """ Ripristina tutto allo stato iniziale. """
         self.bitboards = [0, 0]
-        self.heights = [col * 7 for col in range(7)]
-        self.counter = 0
\ No newline at end of file
+        self.mask = 0
+        self.counter = 0
+        self.mirrored_key = 0
+        if self.tracker is not None:
+            self.tracker.rebuild(self)
\ No newline at end of file
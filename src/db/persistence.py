@@ -1,25 +1,117 @@
 import sqlite3
 import json
+import queue
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 import os
 
+from src.board.engine import GameEngine
+
 # Calcolo automatico del percorso
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 DB_PATH = os.path.join(BASE_DIR, "data", "connect4_factory.db")
 
 
 class GamePersistence:
+    """
+    Accesso al DB SQLite con una connessione a lunga vita per thread (e per processo:
+    dopo un fork il figlio ne apre una sua). Journal WAL e pragma per scritture frequenti.
+    Le scritture passano da transaction(); batch() raggruppa più chiamate in un solo commit.
+    """
+
+    # Pagine di cache per connessione: valore negativo = KiB (16 MB)
+    CACHE_SIZE_KB = 16 * 1024
+
+    # Schema corrente dell'Opening Book
+    OPENING_BOOK_SCHEMA = '''
+                          CREATE TABLE IF NOT EXISTS opening_book
+                          (
+                              state_key   INTEGER NOT NULL,
+                              move_col    INTEGER NOT NULL,
+                              visits      INTEGER DEFAULT 0,
+                              total_score INTEGER DEFAULT 0,
+                              PRIMARY KEY (state_key, move_col)
+                          ) WITHOUT ROWID
+                          '''
+
     def __init__(self, db_path=DB_PATH):
         self.db_path = db_path
         # Crea la cartella 'data' se non esiste
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._local = threading.local()
         self._init_db()
 
+    # --- CONNESSIONE E TRANSAZIONI ---
+
+    def _connection(self):
+        """ Connessione del thread corrente, aperta e configurata al primo uso. """
+        local = self._local
+        conn = getattr(local, "conn", None)
+        if conn is None or local.pid != os.getpid():
+            # isolation_level=None: niente BEGIN impliciti, le transazioni le apre transaction()
+            conn = sqlite3.connect(self.db_path, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # In WAL, NORMAL resta consistente: al massimo si perde l'ultimo commit in caso di crash
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA cache_size=-{self.CACHE_SIZE_KB}")
+            local.conn = conn
+            local.pid = os.getpid()
+            local.depth = 0
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """
+        Transazione esplicita: commit all'uscita, rollback su eccezione.
+        Annidabile: solo la più esterna apre e chiude, le interne la riutilizzano.
+        Restituisce un cursore.
+        """
+        conn = self._connection()
+        local = self._local
+        if local.depth:
+            local.depth += 1
+            try:
+                yield conn.cursor()
+            finally:
+                local.depth -= 1
+            return
+
+        local.depth = 1
+        conn.execute("BEGIN")
+        try:
+            yield conn.cursor()
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+        finally:
+            local.depth = 0
+
+    @contextmanager
+    def batch(self):
+        """
+        Raggruppa più chiamate (save_game_result, update_opening_move, ...)
+        in un'unica transazione:  with db.batch(): ...
+        """
+        with self.transaction():
+            yield self
+
+    def close(self):
+        """ Chiude la connessione del thread corrente (se ne verrà aperta una nuova al prossimo uso). """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.conn = None
+
     def _init_db(self):
         """ Crea le tabelle necessarie se non esistono. """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.transaction() as cursor:
+            self._create_schema(cursor)
 
+    def _create_schema(self, cursor):
         # 1. Tabella Storico Partite
         cursor.execute('''
                        CREATE TABLE IF NOT EXISTS games
@@ -38,74 +130,192 @@ class GamePersistence:
                            moves_count
                            INTEGER,
                            biases_json
-                           TEXT
+                           TEXT,
+                           moves
+                           BLOB,
+                           starting_player
+                           INTEGER,
+                           seed
+                           INTEGER
                        )
                        ''')
 
+        # Log delle mosse (un byte per mossa), primo giocatore e seed della partita:
+        # sui DB creati prima li aggiungiamo (NULL per le partite vecchie).
+        games_columns = {row[1] for row in cursor.execute("PRAGMA table_info(games)")}
+        for column, sql_type in (("moves", "BLOB"), ("starting_player", "INTEGER"), ("seed", "INTEGER")):
+            if column not in games_columns:
+                cursor.execute(f"ALTER TABLE games ADD COLUMN {column} {sql_type}")
+
         # 2. Tabella Opening Book (Apprendimento Aperture)
-        # Chiave primaria composta (stato + mossa) per evitare duplicati
+        # Chiave intera a 64 bit (GameEngine.canonical_key) + mossa, clusterizzata
+        # sulla chiave primaria composta: WITHOUT ROWID, quindi nessun indice separato.
+        if self._has_legacy_opening_book(cursor):
+            self._migrate_legacy_opening_book(cursor)
+        else:
+            cursor.execute(self.OPENING_BOOK_SCHEMA)
+
+        # 3. Indice per avversario: l'ultima partita di un bot è un seek, non una scansione
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_games_opponent ON games (opponent, id)")
+
+        # 4. Riepilogo per avversario, mantenuto a ogni INSERT in games dal trigger:
+        # contatori, mosse totali e ultimo profilo. Le statistiche diventano una lookup.
+        summary_exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'opponent_summary'").fetchone()
         cursor.execute('''
-                       CREATE TABLE IF NOT EXISTS opening_book
+                       CREATE TABLE IF NOT EXISTS opponent_summary
                        (
-                           state_hash
-                           TEXT,
-                           move_col
-                           INTEGER,
-                           visits
-                           INTEGER
-                           DEFAULT
-                           0,
-                           total_score
-                           INTEGER
-                           DEFAULT
-                           0,
-                           PRIMARY
-                           KEY
-                       (
-                           state_hash,
-                           move_col
+                           opponent           TEXT PRIMARY KEY,
+                           games              INTEGER NOT NULL DEFAULT 0,
+                           wins               INTEGER NOT NULL DEFAULT 0,
+                           losses             INTEGER NOT NULL DEFAULT 0,
+                           draws              INTEGER NOT NULL DEFAULT 0,
+                           moves_total        INTEGER NOT NULL DEFAULT 0,
+                           latest_game_id     INTEGER,
+                           latest_biases_json TEXT
                        )
-                           )
                        ''')
+        cursor.execute('''
+                       CREATE TRIGGER IF NOT EXISTS trg_games_summary
+                           AFTER INSERT ON games
+                       BEGIN
+                           INSERT INTO opponent_summary (opponent, games, wins, losses, draws, moves_total,
+                                                         latest_game_id, latest_biases_json)
+                           VALUES (NEW.opponent, 1,
+                                   NEW.result = 'win', NEW.result = 'loss', NEW.result = 'draw',
+                                   COALESCE(NEW.moves_count, 0), NEW.id, NEW.biases_json)
+                           ON CONFLICT(opponent) DO UPDATE SET
+                               games = games + 1,
+                               wins = wins + excluded.wins,
+                               losses = losses + excluded.losses,
+                               draws = draws + excluded.draws,
+                               moves_total = moves_total + excluded.moves_total,
+                               latest_game_id = excluded.latest_game_id,
+                               latest_biases_json = excluded.latest_biases_json;
+                       END
+                       ''')
+        if not summary_exists:
+            # Prima apertura con il riepilogo: lo ricostruiamo dallo storico esistente
+            cursor.execute('''
+                           INSERT INTO opponent_summary (opponent, games, wins, losses, draws, moves_total,
+                                                         latest_game_id, latest_biases_json)
+                           SELECT g.opponent,
+                                  COUNT(*),
+                                  SUM(g.result = 'win'),
+                                  SUM(g.result = 'loss'),
+                                  SUM(g.result = 'draw'),
+                                  COALESCE(SUM(g.moves_count), 0),
+                                  MAX(g.id),
+                                  (SELECT biases_json FROM games WHERE opponent = g.opponent ORDER BY id DESC LIMIT 1)
+                           FROM games g
+                           WHERE g.opponent IS NOT NULL
+                           GROUP BY g.opponent
+                           ''')
 
-        conn.commit()
-        conn.close()
+    @staticmethod
+    def _has_legacy_opening_book(cursor):
+        """ True se opening_book è ancora nel vecchio formato (chiave TEXT state_hash). """
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(opening_book)")]
+        return "state_hash" in columns
 
-    def save_game_result(self, opponent_name, result, final_biases, moves_count):
+    @staticmethod
+    def _legacy_state_key(state_hash):
+        """ Chiave position + mask di una vecchia chiave testuale ("p1_p2" o già numerica). """
+        if "_" in state_hash:
+            # Formato "p1_p2": p1 + (p1 | p2), come GameEngine.get_key()
+            p1, p2 = (int(part) for part in state_hash.split("_"))
+            return p1 + (p1 | p2)
+        return int(state_hash)
+
+    def _migrate_legacy_opening_book(self, cursor):
+        """
+        Converte il vecchio opening_book (state_hash TEXT) nello schema a chiave intera.
+        Le chiavi testuali possono essere nel formato "p1_p2" o già position + mask:
+        entrambe diventano la chiave canonica di GameEngine.canonical_key, con la colonna
+        riflessa per gli stati speculari; le righe che finiscono sulla stessa
+        (chiave, mossa) vengono sommate. Gira nella transazione del chiamante.
+        Restituisce (righe lette, righe scritte).
+        """
+        cursor.execute("ALTER TABLE opening_book RENAME TO opening_book_legacy")
+        cursor.execute(self.OPENING_BOOK_SCHEMA)
+
+        merged = {}
+        rows = cursor.execute("SELECT state_hash, move_col, visits, total_score FROM opening_book_legacy").fetchall()
+        for state_hash, move_col, visits, total_score in rows:
+            key, mirrored = GameEngine.canonical_key(self._legacy_state_key(state_hash))
+            if mirrored: move_col = 6 - move_col
+            entry = merged.setdefault((key, move_col), [0, 0])
+            entry[0] += visits
+            entry[1] += total_score
+
+        # Inserimento in ordine di chiave: il B-tree si riempie in append
+        cursor.executemany('''
+                           INSERT INTO opening_book (state_key, move_col, visits, total_score)
+                           VALUES (?, ?, ?, ?)
+                           ''', [(key, move, visits, score) for (key, move), (visits, score) in sorted(merged.items())])
+        cursor.execute("DROP TABLE opening_book_legacy")
+        return len(rows), len(merged)
+
+    def save_game_result(self, opponent_name, result, final_biases, moves_count,
+                         moves=None, starting_player=None, seed=None):
         """
         Salva i dati della partita.
         result: deve essere una stringa tipo 'win', 'loss', 'draw'
+        moves: colonne giocate in ordine (opzionale), salvate come BLOB da un byte per mossa
+        nella stessa riga (e quindi nella stessa transazione) del risultato.
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
         biases_str = json.dumps(final_biases)
+        moves_blob = bytes(moves) if moves is not None else None
 
-        cursor.execute('''
-                       INSERT INTO games (timestamp, opponent, result, moves_count, biases_json)
-                       VALUES (?, ?, ?, ?, ?)
-                       ''', (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                             opponent_name, result, moves_count, biases_str))
+        with self.transaction() as cursor:
+            cursor.execute('''
+                           INSERT INTO games (timestamp, opponent, result, moves_count, biases_json,
+                                              moves, starting_player, seed)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                           ''', (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                                 opponent_name, result, moves_count, biases_str,
+                                 moves_blob, starting_player, seed))
 
-        conn.commit()
-        conn.close()
+    def iter_game_logs(self, opponent_name=None, chunk_size=1000, after_id=0):
+        """
+        Generatore sulle partite con log delle mosse, in ordine di id.
+        Legge a blocchi di chunk_size righe (paginazione sull'id): la memoria resta
+        costante e nessuna transazione di lettura rimane aperta tra un blocco e l'altro.
+        Produce tuple (id, opponent, result, starting_player, seed, moves),
+        con moves come bytes (iterandolo si ottengono le colonne).
+        """
+        conn = self._connection()
+        last_id = after_id
+        while True:
+            if opponent_name is None:
+                rows = conn.execute('''
+                                    SELECT id, opponent, result, starting_player, seed, moves
+                                    FROM games
+                                    WHERE id > ? AND moves IS NOT NULL
+                                    ORDER BY id LIMIT ?
+                                    ''', (last_id, chunk_size)).fetchall()
+            else:
+                rows = conn.execute('''
+                                    SELECT id, opponent, result, starting_player, seed, moves
+                                    FROM games
+                                    WHERE opponent = ? AND id > ? AND moves IS NOT NULL
+                                    ORDER BY id LIMIT ?
+                                    ''', (opponent_name, last_id, chunk_size)).fetchall()
+            if not rows: return
+            yield from rows
+            last_id = rows[-1][0]
 
     def get_latest_biases(self, opponent_name):
         """ Recupera l'ultimo profilo psicologico noto di questo avversario. """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-                       SELECT biases_json
-                       FROM games
+        cursor = self._connection().execute('''
+                       SELECT latest_biases_json
+                       FROM opponent_summary
                        WHERE opponent = ?
-                       ORDER BY id DESC LIMIT 1
                        ''', (opponent_name,))
 
         row = cursor.fetchone()
-        conn.close()
 
-        if row:
+        if row and row[0]:
             try:
                 return json.loads(row[0])
             except json.JSONDecodeError:
@@ -114,87 +324,205 @@ class GamePersistence:
 
     # --- METODI OTTIMIZZATI PER L'APERTURA ---
 
-    def update_opening_move(self, state_hash, move_col, score_delta):
+    def update_opening_move(self, state_key, move_col, score_delta):
         """
         Aggiorna statistiche mossa usando UPSERT (Insert o Update atomico).
         Molto più veloce e sicuro del "Select -> If -> Update/Insert".
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
         # Questa query fa tutto da sola:
         # 1. Prova a INSERIRE una nuova riga.
         # 2. Se esiste già (conflitto su Primary Key), AGGIORNA i valori esistenti.
-        cursor.execute('''
-                       INSERT INTO opening_book (state_hash, move_col, visits, total_score)
-                       VALUES (?, ?, 1, ?) ON CONFLICT(state_hash, move_col) DO
-                       UPDATE SET
-                           visits = visits + 1,
-                           total_score = total_score + excluded.total_score
-                       ''', (state_hash, move_col, score_delta))
+        with self.transaction() as cursor:
+            cursor.execute('''
+                           INSERT INTO opening_book (state_key, move_col, visits, total_score)
+                           VALUES (?, ?, 1, ?) ON CONFLICT(state_key, move_col) DO
+                           UPDATE SET
+                               visits = visits + 1,
+                               total_score = total_score + excluded.total_score
+                           ''', (state_key, move_col, score_delta))
 
-        conn.commit()
-        conn.close()
+    def load_opening_book(self):
+        """
+        Tutto l'Opening Book in una sola query (per la cache in memoria di OpeningManager).
+        Output: lista di tuple [(state_key, move_col, visits, total_score), ...]
+        """
+        cursor = self._connection().execute('''
+                       SELECT state_key, move_col, visits, total_score
+                       FROM opening_book
+                       ''')
+        return cursor.fetchall()
 
-    def get_opening_stats(self, state_hash):
+    def apply_opening_deltas(self, deltas):
+        """
+        Scrive in un'unica transazione (un solo executemany UPSERT) gli incrementi
+        accumulati in memoria da OpeningManager, già sommati per (stato, mossa).
+        Dentro batch(), come nel thread di AsyncPersistenceWriter, finisce nello
+        stesso commit delle righe games accodate insieme.
+        deltas: lista di tuple [(state_key, move_col, visits_delta, score_delta), ...]
+        """
+        if not deltas: return
+        with self.transaction() as cursor:
+            cursor.executemany('''
+                               INSERT INTO opening_book (state_key, move_col, visits, total_score)
+                               VALUES (?, ?, ?, ?) ON CONFLICT(state_key, move_col) DO
+                               UPDATE SET
+                                   visits = visits + excluded.visits,
+                                   total_score = total_score + excluded.total_score
+                               ''', deltas)
+
+    def get_opening_stats(self, state_key):
         """
         Restituisce tutte le mosse note per questo stato.
         Output: lista di tuple [(move_col, visits, total_score), ...]
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
+        cursor = self._connection().execute('''
                        SELECT move_col, visits, total_score
                        FROM opening_book
-                       WHERE state_hash = ?
-                       ''', (state_hash,))
-
-        results = cursor.fetchall()
-        conn.close()
-        return results
+                       WHERE state_key = ?
+                       ''', (state_key,))
+        return cursor.fetchall()
 
     def get_stats_for_docs(self, opponent_name):
-        """ Calcola statistiche aggregate per visualizzazione. """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
+        """ Calcola statistiche aggregate per visualizzazione (dal riepilogo, senza scansioni). """
         # Assumiamo che 'result' sia salvato come 'win' nel DB quando vince l'umano
-        cursor.execute('''
-                       SELECT COUNT(*),
-                              AVG(moves_count),
-                              SUM(CASE WHEN result = 'win' THEN 1 ELSE 0 END)
-                       FROM games
+        cursor = self._connection().execute('''
+                       SELECT games, moves_total, wins
+                       FROM opponent_summary
                        WHERE opponent = ?
                        ''', (opponent_name,))
 
-        total, avg_moves, wins = cursor.fetchone()
-        conn.close()
-
-        if total == 0: return None
+        row = cursor.fetchone()
+        if not row or row[0] == 0: return None
 
+        total, moves_total, wins = row
         return {
             "total_games": total,
             "win_rate": (wins / total) * 100 if wins else 0,
-            "avg_moves": round(avg_moves if avg_moves else 0, 2)
+            "avg_moves": round(moves_total / total, 2)
         }
 
     def get_total_stats_by_bot(self, opponent_name):
         """ Recupera vittorie, sconfitte e pareggi storici contro un bot specifico. """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            SELECT 
-                SUM(CASE WHEN result = 'win' THEN 1 ELSE 0 END),
-                SUM(CASE WHEN result = 'loss' THEN 1 ELSE 0 END),
-                SUM(CASE WHEN result = 'draw' THEN 1 ELSE 0 END)
-            FROM games
-            WHERE opponent = ?
-        ''', (opponent_name,))
+        cursor = self._connection().execute('''
+                       SELECT wins, losses, draws
+                       FROM opponent_summary
+                       WHERE opponent = ?
+                       ''', (opponent_name,))
 
         stats = cursor.fetchone()
-        conn.close()
 
         # Restituisce (0, 0, 0) se non ci sono partite nel DB
-        return tuple(s if s is not None else 0 for s in stats)
\ No newline at end of file
+        return stats if stats else (0, 0, 0)
+
+
+class AsyncPersistenceWriter:
+    """
+    Scritture su DB in un thread dedicato, per non fermare il ciclo di gioco sull'I/O.
+    - Coda limitata: se il writer resta indietro, put() blocca il chiamante (backpressure).
+    - Il thread raccoglie le richieste in blocchi e fa un solo commit per blocco,
+      quando raggiunge batch_size richieste o max_delay secondi dalla prima.
+    - close() svuota la coda e attende l'ultimo commit: a fine sessione tutto è su disco.
+    Espone gli stessi metodi di scrittura di GamePersistence (e load_opening_book),
+    quindi può sostituirla dove serve solo scrivere, ad esempio in OpeningManager.
+    """
+
+    # Segnale di chiusura in coda
+    _STOP = object()
+
+    def __init__(self, persistence, max_queue=1024, batch_size=64, max_delay=0.5):
+        self.persistence = persistence
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.error = None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="persistence-writer", daemon=True)
+        self._thread.start()
+
+    # --- API (stesse firme di GamePersistence) ---
+
+    def save_game_result(self, opponent_name, result, final_biases, moves_count,
+                         moves=None, starting_player=None, seed=None):
+        self._submit("save_game_result", opponent_name, result, final_biases, moves_count,
+                     list(moves) if moves is not None else None, starting_player, seed)
+
+    def apply_opening_deltas(self, deltas):
+        self._submit("apply_opening_deltas", deltas)
+
+    def load_opening_book(self):
+        """ Lettura coerente: prima attende che le scritture in coda siano committate. """
+        self.flush()
+        return self.persistence.load_opening_book()
+
+    def flush(self):
+        """ Blocca finché tutte le richieste accodate non sono state scritte. """
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """
+        Svuota la coda e chiude il thread (e la sua connessione). Idempotente.
+        Un errore in sospeso non interrompe lo svuotamento: viene sollevato dopo.
+        """
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+        self._raise_error()
+
+    # --- THREAD DI SCRITTURA ---
+
+    def _submit(self, method, *args):
+        self._raise_error()
+        if not self._thread.is_alive():
+            raise RuntimeError("AsyncPersistenceWriter: writer già chiuso")
+        self._queue.put((method, args))
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _run(self):
+        q = self._queue
+        stop = False
+        while not stop:
+            item = q.get()
+            if item is self._STOP:
+                q.task_done()
+                break
+
+            # Raccolta del blocco: fino a batch_size richieste o max_delay secondi
+            pending = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(pending) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0: break
+                try:
+                    item = q.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stop = True
+                    q.task_done()
+                    break
+                pending.append(item)
+
+            try:
+                with self.persistence.batch():
+                    for method, args in pending:
+                        getattr(self.persistence, method)(*args)
+            except Exception:
+                # Il blocco è stato annullato (rollback): lo riapplichiamo una richiesta
+                # per volta, così si perde solo quella che fallisce
+                self._apply_one_by_one(pending)
+            finally:
+                for _ in pending: q.task_done()
+
+        self.persistence.close()
+
+    def _apply_one_by_one(self, pending):
+        for method, args in pending:
+            try:
+                getattr(self.persistence, method)(*args)
+            except Exception as e:
+                # Il primo errore resta quello segnalato al chiamante
+                if self.error is None: self.error = e
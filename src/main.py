@@ -88,19 +88,21 @@ def main():
                 if event.type == pygame.QUIT: pygame.quit(); sys.exit()
 
                 if event.type == pygame.KEYDOWN:
+                    # Errore "umano" dei bot: softmax sugli score della radice (temperature in
+                    # punti evaluator), tarata sulla forza del vecchio rumore del ±20% sulle foglie.
                     # Tasto 1: Novizio (Casual)
                     if event.key == pygame.K_1:
-                        selected_bot = MinimaxAgent(engine, CasualEvaluator(), depth=2)
+                        selected_bot = MinimaxAgent(engine, CasualEvaluator(), depth=2, temperature=1.0)
                         bot_db_name = "casual_novice"
 
                     # Tasto 2: Bias Diagonale (Training Target)
                     elif event.key == pygame.K_2:
-                        selected_bot = MinimaxAgent(engine, DiagonalBlinderEvaluator(), depth=4)
+                        selected_bot = MinimaxAgent(engine, DiagonalBlinderEvaluator(), depth=4, temperature=0.75)
                         bot_db_name = "diagonal_blinder"
 
                     # Tasto 3: Edge Runner (Strategia alternativa)
                     elif event.key == pygame.K_3:
-                        selected_bot = MinimaxAgent(engine, EdgeRunnerEvaluator(), depth=3)
+                        selected_bot = MinimaxAgent(engine, EdgeRunnerEvaluator(), depth=3, temperature=3.0)
                         bot_db_name = "edge_runner"
 
                     # Tasto 4: IA Adattiva (Impara dall'umano live)
@@ -124,7 +126,7 @@ def main():
                     latest_biases = persistence.get_latest_biases(bot_db_name)
                     if latest_biases:
                         print(f"[SYSTEM] Caricati bias storici per {bot_db_name}: {latest_biases}")
-                        controller.profiler.biases = latest_biases
+                        controller.profiler.set_biases(latest_biases)
                     else:
                         # Se è la prima volta, resettiamo il profiler per imparare da zero
                         print(f"[SYSTEM] Nuovo avversario {bot_db_name}. Profiler resettato.")
@@ -151,6 +153,8 @@ def main():
                 col = bot.choose_move(1)
 
                 # Aggiorniamo la barra EVAL in base alla valutazione del bot
+                # (prepare: i coefficienti seguono i bias aggiornati dal profiler)
+                bot.evaluator.prepare()
                 controller.stats["ai_eval"] = bot.evaluator.evaluate(engine, 1)
 
                 if col is not None:
@@ -194,6 +198,7 @@ def main():
 
                             # Se stiamo giocando contro IA, aggiorniamo l'Eval Bar
                             if game_mode == "PVE" and bot:
+                                bot.evaluator.prepare()
                                 controller.stats["ai_eval"] = bot.evaluator.evaluate(engine, 1)
 
                             if win:
@@ -1,71 +1,189 @@
 """
 scripts/analyze_results.py
 Analizza il database SQLite e genera report statistici per la documentazione.
+Un solo passaggio in streaming sulla tabella games, ordinata per (opponent, id)
+(l'indice idx_games_opponent): per ogni avversario teniamo solo accumulatori
+e finestre di dimensione fissa, quindi la memoria non cresce con lo storico.
+In alternativa (--sql) le finestre della curva di apprendimento le calcola SQLite
+con le window function.
 """
 import sqlite3
 import json
 import os
+import sys
+from collections import deque
+from itertools import groupby
 
+# Partite (vinte) nelle finestre iniziale/finale della curva di apprendimento
+CURVE_WINDOW = 10
+# Vittorie minime per considerare significativa la curva
+CURVE_MIN_WINS = 20
+# Partite nella media mobile del win rate
+ROLLING_WINDOW = 100
+# Ultime partite usate per il bias medio
+BIAS_WINDOW = 10
+# Righe lette per volta dal cursore
+FETCH_SIZE = 5000
 
-def analyze_all_data(db_path="data/connect4_factory.db"):
+
+class OpponentStats:
+    """ Accumulatori di un avversario, aggiornati una partita alla volta (memoria costante). """
+
+    def __init__(self, opponent):
+        self.opponent = opponent
+        self.total = 0
+        self.wins = 0
+        self.moves_total = 0
+        # Media mobile del win rate sulle ultime ROLLING_WINDOW partite
+        self.recent_results = deque(maxlen=ROLLING_WINDOW)
+        self.recent_wins = 0
+        # Curva di apprendimento: mosse delle prime e delle ultime vittorie
+        self.wins_seen = 0
+        self.first_win_moves = 0
+        self.last_win_moves = deque(maxlen=CURVE_WINDOW)
+        # Profili delle ultime partite, ancora in JSON: li decodifichiamo solo alla fine
+        self.recent_biases = deque(maxlen=BIAS_WINDOW)
+
+    def add(self, result, moves_count, biases_json):
+        won = result == "win"
+        moves_count = moves_count or 0
+
+        self.total += 1
+        self.wins += won
+        self.moves_total += moves_count
+
+        if len(self.recent_results) == ROLLING_WINDOW:
+            self.recent_wins -= self.recent_results[0]
+        self.recent_results.append(won)
+        self.recent_wins += won
+
+        if won:
+            if self.wins_seen < CURVE_WINDOW: self.first_win_moves += moves_count
+            self.wins_seen += 1
+            self.last_win_moves.append(moves_count)
+
+        if biases_json: self.recent_biases.append(biases_json)
+
+    def win_rate(self):
+        return (self.wins / self.total) * 100 if self.total else 0.0
+
+    def rolling_win_rate(self):
+        return (self.recent_wins / len(self.recent_results)) * 100 if self.recent_results else 0.0
+
+    def avg_moves(self):
+        return self.moves_total / self.total if self.total else 0.0
+
+    def learning_curve(self):
+        """ (media mosse prime vittorie, media ultime vittorie) o None se troppo poche. """
+        if self.wins_seen <= CURVE_MIN_WINS: return None
+        return self.first_win_moves / CURVE_WINDOW, sum(self.last_win_moves) / CURVE_WINDOW
+
+    def average_biases(self):
+        """ Vettore dei bias mediato sulle ultime BIAS_WINDOW partite (ogni chiave sui profili che la contengono). """
+        sums = {}
+        counts = {}
+        for biases_json in self.recent_biases:
+            try:
+                biases = json.loads(biases_json)
+            except json.JSONDecodeError:
+                continue
+            for k, v in biases.items():
+                sums[k] = sums.get(k, 0.0) + v
+                counts[k] = counts.get(k, 0) + 1
+        return {k: v / counts[k] for k, v in sums.items()}
+
+
+def _iter_rows(cursor):
+    """ Righe del cursore a blocchi di FETCH_SIZE, senza caricare la tabella. """
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows: return
+        yield from rows
+
+
+def stream_opponent_stats(conn):
+    """
+    Generatore: un OpponentStats per avversario, completo, in un solo passaggio
+    ordinato per (opponent, id). In memoria c'è un solo avversario alla volta.
+    """
+    cursor = conn.execute('''
+        SELECT opponent, result, moves_count, biases_json
+        FROM games
+        WHERE opponent IS NOT NULL
+        ORDER BY opponent, id
+    ''')
+    for opponent, rows in groupby(_iter_rows(cursor), key=lambda row: row[0]):
+        stats = OpponentStats(opponent)
+        for _, result, moves_count, biases_json in rows:
+            stats.add(result, moves_count, biases_json)
+        yield stats
+
+
+def learning_curves_sql(conn):
+    """
+    Curva di apprendimento calcolata da SQLite con le window function:
+    numera le vittorie di ogni avversario in avanti e all'indietro e media
+    le mosse delle prime e delle ultime CURVE_WINDOW.
+    Output: {opponent: (media prime, media ultime)}, solo oltre CURVE_MIN_WINS vittorie.
+    """
+    cursor = conn.execute('''
+        SELECT opponent,
+               AVG(CASE WHEN rn_first <= :window THEN moves_count END),
+               AVG(CASE WHEN rn_last <= :window THEN moves_count END)
+        FROM (SELECT opponent,
+                     moves_count,
+                     ROW_NUMBER() OVER (PARTITION BY opponent ORDER BY id ASC)  AS rn_first,
+                     ROW_NUMBER() OVER (PARTITION BY opponent ORDER BY id DESC) AS rn_last,
+                     COUNT(*) OVER (PARTITION BY opponent)                      AS n_wins
+              FROM games
+              WHERE result = 'win' AND opponent IS NOT NULL)
+        WHERE n_wins > :min_wins
+        GROUP BY opponent
+    ''', {"window": CURVE_WINDOW, "min_wins": CURVE_MIN_WINS})
+    return {opponent: (first_avg, last_avg) for opponent, first_avg, last_avg in cursor}
+
+
+def analyze_all_data(db_path="data/connect4_factory.db", use_window_functions=False):
     if not os.path.exists(db_path):
         print("Errore: Database non trovato!")
         return
 
     conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    # 1. Statistiche Generali per Bot
-    cursor.execute('''
-        SELECT opponent, 
-               COUNT(*) as total,
-               SUM(CASE WHEN result = 'win' THEN 1 ELSE 0 END) as wins,
-               AVG(moves_count) as avg_moves
-        FROM games 
-        GROUP BY opponent
-    ''')
-    rows = cursor.fetchall()
 
     print("\n" + "=" * 50)
     print("📊 REPORT PERFORMANCE IA (Dati per Documentazione)")
     print("=" * 50)
 
     # Formattazione per tabella Markdown
-    markdown_table = "| Bot Avversario | Partite | Win Rate | Avg Moves | Bias Finale Medio |\n"
-    markdown_table += "| :--- | :---: | :---: | :---: | :--- |\n"
+    markdown_table = f"| Bot Avversario | Partite | Win Rate | Win Rate (ultime {ROLLING_WINDOW}) | Avg Moves | Bias Medio (ultime {BIAS_WINDOW}) |\n"
+    markdown_table += "| :--- | :---: | :---: | :---: | :---: | :--- |\n"
 
-    for row in rows:
-        opp, total, wins, avg_m = row
-        win_rate = (wins / total) * 100
+    curves = []
+    for stats in stream_opponent_stats(conn):
+        # Mostriamo solo i bias che si sono spostati dal valore neutro
+        avg_bias = stats.average_biases()
+        avg_bias_str = ", ".join(f"{k}: {v:.2f}" for k, v in avg_bias.items() if v != 1.0) or "N/A"
 
-        # Estraiamo il bias medio per questo bot (es. quanto è salito diagonal_weakness)
-        cursor.execute('SELECT biases_json FROM games WHERE opponent = ? ORDER BY id DESC LIMIT 10', (opp,))
-        last_biases = cursor.fetchall()
-
-        # Calcoliamo una media rapida dei bias rilevati nelle ultime 10 partite
-        avg_bias_str = "N/A"
-        if last_biases:
-            # Esempio: prendiamo il diagonal_weakness o center_weight a seconda del bot
-            sample = json.loads(last_biases[0][0])
-            avg_bias_str = ", ".join([f"{k}: {v:.2f}" for k, v in sample.items() if v != 1.0])
-
-        markdown_table += f"| {opp} | {total} | {win_rate:.1f}% | {avg_m:.1f} | {avg_bias_str} |\n"
+        markdown_table += (f"| {stats.opponent} | {stats.total} | {stats.win_rate():.1f}% | "
+                           f"{stats.rolling_win_rate():.1f}% | {stats.avg_moves():.1f} | {avg_bias_str} |\n")
+        curves.append((stats.opponent, stats.learning_curve()))
 
     print(markdown_table)
 
     # 2. Analisi della Curva di Apprendimento
-    # Controlliamo se la media delle mosse scende nelle ultime partite rispetto alle prime
-    for opp in [r[0] for r in rows]:
-        cursor.execute('SELECT moves_count FROM games WHERE opponent = ? AND result = "win" ORDER BY id ASC', (opp,))
-        moves = [m[0] for m in cursor.fetchall()]
-        if len(moves) > 20:
-            first_avg = sum(moves[:10]) / 10
-            last_avg = sum(moves[-10:]) / 10
-            improvement = ((first_avg - last_avg) / first_avg) * 100
-            print(f"📈 Apprendimento vs {opp}: Efficienza migliorata del {improvement:.1f}%")
+    # Controlliamo se la media delle mosse (nelle vittorie) scende nelle ultime partite rispetto alle prime
+    if use_window_functions:
+        by_opponent = learning_curves_sql(conn)
+        curves = [(opp, by_opponent.get(opp)) for opp, _ in curves]
+
+    for opp, curve in curves:
+        if curve is None: continue
+        first_avg, last_avg = curve
+        improvement = ((first_avg - last_avg) / first_avg) * 100
+        print(f"📈 Apprendimento vs {opp}: Efficienza migliorata del {improvement:.1f}%")
 
     conn.close()
 
 
 if __name__ == "__main__":
-    analyze_all_data()
\ No newline at end of file
+    analyze_all_data(use_window_functions="--sql" in sys.argv[1:])
@@ -0,0 +1,43 @@
+"""
+script/export_opening_book.py
+Compila la tabella opening_book (stati fino a MAX_BOOK_DEPTH pedine) nel file
+binario di sola lettura usato da OpeningManager(book_path=...).
+Per le installazioni che giocano soltanto: niente SQLite, avvio immediato,
+pagine condivise tra i processi che aprono lo stesso file.
+
+Uso: python src/script/export_opening_book.py [percorso_db] [file_output]
+"""
+import sys
+import os
+import time
+
+# Aggiunge la root del progetto al path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.ai.book_file import write_book
+from src.ai.opening_manager import OpeningManager
+from src.db.persistence import GamePersistence, DB_PATH
+
+BOOK_PATH = os.path.join(os.path.dirname(DB_PATH), "opening_book.bin")
+
+
+def export_book(db_path=DB_PATH, out_path=BOOK_PATH, max_depth=OpeningManager.MAX_BOOK_DEPTH):
+    if not os.path.exists(db_path):
+        print("Errore: Database non trovato!")
+        return
+
+    start = time.perf_counter()
+    db = GamePersistence(db_path)
+    rows = db.load_opening_book()
+    db.close()
+
+    count = write_book(rows, out_path, max_depth)
+    elapsed = time.perf_counter() - start
+
+    print(f"Opening Book compilato: {count} record (su {len(rows)}) fino a {max_depth} pedine")
+    print(f"File: {out_path} ({os.path.getsize(out_path) / 1024:.0f} KiB) in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    export_book(sys.argv[1] if len(sys.argv) > 1 else DB_PATH,
+                sys.argv[2] if len(sys.argv) > 2 else BOOK_PATH)
@@ -0,0 +1,99 @@
+"""
+script/migrate_opening_book.py
+Migrazione una tantum dell'Opening Book allo schema a chiave intera.
+Vecchio schema: state_hash TEXT ("p1_p2" o position + mask come stringa) + indice automatico.
+Nuovo schema:   state_key INTEGER (chiave canonica) + move_col, WITHOUT ROWID.
+La conversione vera e propria è in GamePersistence (scatta anche all'apertura di un DB
+vecchio); qui la eseguiamo esplicitamente, compattiamo il file con VACUUM e
+confrontiamo dimensione su disco e latenza di lookup prima e dopo.
+
+Uso: python src/script/migrate_opening_book.py [percorso_db]
+"""
+import sys
+import os
+import time
+import random
+import sqlite3
+
+# Aggiunge la root del progetto al path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.board.engine import GameEngine
+from src.db.persistence import GamePersistence, DB_PATH
+
+# Lookup cronometrati per la misura di latenza
+LOOKUP_SAMPLES = 20000
+
+
+def _book_size(conn):
+    """ Byte occupati da opening_book e dai suoi indici (dbstat, se disponibile). """
+    try:
+        row = conn.execute('''
+                           SELECT SUM(pgsize)
+                           FROM dbstat
+                           WHERE name = 'opening_book'
+                              OR name LIKE 'sqlite_autoindex_opening_book%'
+                           ''').fetchone()
+        return row[0] or 0
+    except sqlite3.OperationalError:
+        return None
+
+
+def _lookup_latency(conn, column, keys):
+    """ Microsecondi medi per SELECT delle mosse di uno stato. """
+    query = f"SELECT move_col, visits, total_score FROM opening_book WHERE {column} = ?"
+    start = time.perf_counter()
+    for key in keys:
+        conn.execute(query, (key,)).fetchall()
+    return (time.perf_counter() - start) / len(keys) * 1e6
+
+
+def _format_size(size):
+    return "n/d" if size is None else f"{size / 1024:.0f} KiB"
+
+
+def migrate(db_path=DB_PATH):
+    if not os.path.exists(db_path):
+        print("Errore: Database non trovato!")
+        return
+
+    conn = sqlite3.connect(db_path)
+    if not GamePersistence._has_legacy_opening_book(conn.cursor()):
+        print("Opening Book già nello schema a chiave intera: niente da fare.")
+        conn.close()
+        return
+
+    # --- PRIMA: schema TEXT ---
+    old_keys = [row[0] for row in conn.execute("SELECT DISTINCT state_hash FROM opening_book")]
+    old_rows = conn.execute("SELECT COUNT(*) FROM opening_book").fetchone()[0]
+    old_size = _book_size(conn)
+    sample = random.choices(old_keys, k=LOOKUP_SAMPLES) if old_keys else []
+    old_latency = _lookup_latency(conn, "state_hash", sample) if sample else 0.0
+    conn.close()
+
+    # --- MIGRAZIONE (un'unica transazione, dentro GamePersistence) ---
+    start = time.perf_counter()
+    db = GamePersistence(db_path)
+    db.close()
+    elapsed = time.perf_counter() - start
+
+    # --- DOPO: schema INTEGER, file compattato ---
+    conn = sqlite3.connect(db_path)
+    conn.execute("VACUUM")
+    new_rows = conn.execute("SELECT COUNT(*) FROM opening_book").fetchone()[0]
+    new_size = _book_size(conn)
+    new_sample = [GameEngine.canonical_key(GamePersistence._legacy_state_key(state_hash))[0]
+                  for state_hash in sample]
+    new_latency = _lookup_latency(conn, "state_key", new_sample) if new_sample else 0.0
+    conn.close()
+
+    print("=" * 50)
+    print(f"Migrazione Opening Book completata in {elapsed:.2f}s")
+    print("=" * 50)
+    print(f"Righe:          {old_rows} -> {new_rows} (stati speculari fusi)")
+    print(f"Spazio su disco: {_format_size(old_size)} -> {_format_size(new_size)}")
+    print(f"Lookup medio:    {old_latency:.1f} us -> {new_latency:.1f} us")
+
+
+if __name__ == "__main__":
+    migrate(sys.argv[1] if len(sys.argv) > 1 else DB_PATH)
@@ -1,23 +1,75 @@
 import sys
 import os
+import json
+import random
+
+import numpy as np
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from src.board.engine import GameEngine
+from src.board.batch_engine import BatchGameEngine
 from src.ai.evaluator import AdaptiveEvaluator
 from src.ai.profiler import OpponentProfiler
 from src.ai.minimax import MinimaxAgent
 from src.ai.opening_manager import OpeningManager
-from src.db.persistence import GamePersistence
+from src.db.persistence import GamePersistence, AsyncPersistenceWriter
 # --- AGGIUNTO PerfectEvaluator QUI SOTTO ---
 from src.ai.bots.training_evaluators import CasualEvaluator, DiagonalBlinderEvaluator, EdgeRunnerEvaluator, \
     PerfectEvaluator
 
 
-def run_training_session(opponent_type="diagonal", iterations=20, silent=False):
+def _opponent_key(opponent_type):
+    """ Nome con cui il profilo dell'avversario è cercato nel DB. """
+    # --- REFATTORIZZATO PER LEGGIBILITÀ ---
+    if opponent_type == "diagonal":
+        return "diagonal_blinder"
+    elif opponent_type == "edge":
+        return "edge_runner"
+    elif opponent_type == "perfect":
+        return "perfect_bot"
+    return "casual_novice"
+
+
+def _opponent_config(opponent_type):
+    """
+    CONFIGURAZIONE AVVERSARIO: (evaluator, depth, temperature alla radice).
+    Le temperature (in punti evaluator) danno all'incirca la stessa forza del vecchio
+    rumore del ±20% sulle foglie: stessa frequenza di mosse peggiori della migliore.
+    """
+    if opponent_type == "diagonal":
+        return DiagonalBlinderEvaluator(), 4, 0.75
+    elif opponent_type == "edge":
+        return EdgeRunnerEvaluator(), 4, 2.0
+    elif opponent_type == "perfect":
+        # IL NUOVO BOT: Profondità alta, NESSUN rumore (0.0)
+        return PerfectEvaluator(), 5, 0.0
+    # Fallback per "casual", "novice" o qualsiasi altro nome
+    return CasualEvaluator(), 2, 1.0
+
+
+def _close_session(opening_manager, writer, db):
+    """
+    Chiusura della persistenza di una sessione: flush delle ultime partite del libro
+    (ancora solo in memoria), poi attesa dell'ultimo commit del writer.
+    Al ritorno tutto è su disco, anche se il flush fallisce; la connessione del DB
+    viene chiusa anche se il writer solleva un errore di scrittura in sospeso.
+    """
+    try:
+        if opening_manager: opening_manager.flush()
+    finally:
+        if writer:
+            try:
+                writer.close()
+            finally:
+                db.close()
+
+
+def run_training_session(opponent_type="diagonal", iterations=20, silent=False, stats_path=None):
     """
     Esegue una sessione di training.
     :param silent: Se True, non stampa il log mossa per mossa, ma solo una barra di avanzamento.
+    :param stats_path: Se indicato, salva le statistiche di ricerca di ogni mossa (JSONL).
     :return: (wins, losses, draws)
     """
     engine = GameEngine()
@@ -27,51 +79,34 @@ def run_training_session(opponent_type="diagonal", iterations=20, silent=False):
     except Exception:
         db = None
 
-    opening_manager = OpeningManager(db) if db else None
+    # Le scritture (partite e libro) vanno al thread di persistenza: il ciclo non attende il disco
+    writer = AsyncPersistenceWriter(db) if db else None
+    opening_manager = OpeningManager(writer) if writer else None
     profiler = OpponentProfiler()
 
     if db:
-        # --- REFATTORIZZATO PER LEGGIBILITÀ ---
-        if opponent_type == "diagonal":
-            opp_key = "diagonal_blinder"
-        elif opponent_type == "edge":
-            opp_key = "edge_runner"
-        elif opponent_type == "perfect":
-            opp_key = "perfect_bot"
-        else:
-            opp_key = "casual_novice"
-
-        past_biases = db.get_latest_biases(opp_key)
+        past_biases = db.get_latest_biases(_opponent_key(opponent_type))
         if past_biases:
-            profiler.biases.update(past_biases)
+            profiler.set_biases(past_biases)
 
     ai_evaluator = AdaptiveEvaluator(profiler)
-    ai_agent = MinimaxAgent(engine, ai_evaluator, depth=4)
+    collect_stats = stats_path is not None
+    stats_file = open(stats_path, "a", encoding="utf-8") if collect_stats else None
 
-    # --- CONFIGURAZIONE AVVERSARIO ---
-    if opponent_type == "diagonal":
-        opp_evaluator = DiagonalBlinderEvaluator()
-        opp_depth = 4
-        opp_noise = 0.1
-    elif opponent_type == "edge":
-        opp_evaluator = EdgeRunnerEvaluator()
-        opp_depth = 4
-        opp_noise = 0.2
-    elif opponent_type == "perfect":
-        # IL NUOVO BOT: Profondità alta, NESSUN rumore (0.0)
-        opp_evaluator = PerfectEvaluator()
-        opp_depth = 5
-        opp_noise = 0.0
-    else:
-        # Fallback per "casual", "novice" o qualsiasi altro nome
-        opp_evaluator = CasualEvaluator()
-        opp_depth = 2
-        opp_noise = 0.3
+    ai_agent = MinimaxAgent(engine, ai_evaluator, depth=4, collect_stats=collect_stats)
 
-    try:
-        opponent_agent = MinimaxAgent(engine, opp_evaluator, depth=opp_depth, randomness=opp_noise)
-    except TypeError:
-        opponent_agent = MinimaxAgent(engine, opp_evaluator, depth=opp_depth)
+    opp_evaluator, opp_depth, opp_temperature = _opponent_config(opponent_type)
+    # Errore "umano" solo alla radice: softmax sugli score esatti (le foglie restano deterministiche)
+    opponent_agent = MinimaxAgent(engine, opp_evaluator, depth=opp_depth, temperature=opp_temperature,
+                                  collect_stats=collect_stats)
+
+    def log_stats(agent, role, game_idx, move):
+        """ Una riga JSONL per ogni mossa calcolata dal Minimax. """
+        if stats_file is None or agent.last_stats is None: return
+        record = {"game": game_idx, "ply": engine.counter, "agent": role, "move": move}
+        record.update(agent.last_stats.to_dict())
+        stats_file.write(json.dumps(record) + "\n")
+        agent.last_stats = None
 
     # Calcolo step per la notifica del 10%
     progress_step = max(1, iterations // 10)
@@ -80,91 +115,231 @@ def run_training_session(opponent_type="diagonal", iterations=20, silent=False):
     draws = 0
     losses = 0
 
-    for i in range(1, iterations + 1):
-        engine.reset()
-        if opening_manager: opening_manager.game_history.clear()
+    try:
+        for i in range(1, iterations + 1):
+            engine.reset()
+            if opening_manager: opening_manager.game_history.clear()
+
+            # Reset Cache
+            ai_agent.transposition_table.clear()
+            opponent_agent.transposition_table.clear()
+
+            starting_player = 0 if i % 2 != 0 else 1
+            moves = 0
+            game_over = False
+            winner = None
+
+            # Seed della partita per il rumore dei bot (salvato con il log delle mosse)
+            seed = random.getrandbits(31)
+            ai_agent.rng.seed(seed)
+            opponent_agent.rng.seed(seed)
+            move_log = []
+
+            while not game_over:
+                if moves >= 42:
+                    game_over = True
+                    winner = "draw"
+                    break
+
+                current_turn = (starting_player + moves) % 2
+
+                if current_turn == 0:
+                    move = None
+                    if opening_manager: move, _ = opening_manager.get_best_move(engine)
+                    if move is None:
+                        move = ai_agent.choose_move(0)
+                        log_stats(ai_agent, "ai", i, move)
+
+                    if move is None:
+                        game_over = True
+                        winner = "draw"
+                    else:
+                        if opening_manager: opening_manager.record_move(engine, move, 0)
+                        engine.drop_piece(move, 0)
+                        move_log.append(move)
+                else:
+                    state_before = engine.get_state()
+                    move = opponent_agent.choose_move(1)
+                    log_stats(opponent_agent, "bot", i, move)
+
+                    if move is None:
+                        game_over = True
+                        winner = "draw"
+                    else:
+                        if opening_manager: opening_manager.record_move(engine, move, 1)
+                        engine.drop_piece(move, 1)
+                        move_log.append(move)
+                        profiler.update(state_before, move, 1)
+
+                moves += 1
+                if not game_over:
+                    if engine.check_victory(current_turn):
+                        game_over = True
+                        winner = "ai" if current_turn == 0 else "bot"
+                    elif len([c for c in range(7) if engine.is_valid_location(c)]) == 0:
+                        game_over = True
+                        winner = "draw"
+
+            # Backpropagation
+            if opening_manager and winner is not None:
+                w_idx = 0 if winner == "ai" else (1 if winner == "bot" else "draw")
+                opening_manager.finalize_game(w_idx)
+
+            # Stats Update
+            result = "loss" if winner == "bot" else ("win" if winner == "ai" else "draw")
+
+            if result == "loss": profiler.cooling_after_loss()
+
+            if winner == "ai":
+                wins += 1
+            elif winner == "bot":
+                losses += 1
+            else:
+                draws += 1
 
-        # Reset Cache
-        ai_agent.transposition_table = {}
-        opponent_agent.transposition_table = {}
+            if writer:
+                writer.save_game_result(opponent_type, result, profiler.get_adaptive_weights(), moves,
+                                        move_log, starting_player, seed)
 
-        starting_player = 0 if i % 2 != 0 else 1
-        moves = 0
-        game_over = False
-        winner = None
+            # --- GESTIONE OUTPUT SILENZIOSO / PROGRESSO ---
+            if not silent:
+                # Vecchio comportamento: stampa tutto
+                icon = "🟢" if winner == "ai" else ("🔴" if winner == "bot" else "⚪")
+                print(f"Match {i:03d} {icon} | {result.upper()} | Moves: {moves}")
+            else:
+                # Nuovo comportamento: Stampa solo al 10, 20, 30... %
+                if i % progress_step == 0 or i == iterations:
+                    percent = (i / iterations) * 100
+                    print(f"   ... Progresso: {percent:.0f}% ({i}/{iterations}) completato.")
+    finally:
+        # Anche su eccezione o Ctrl-C: le partite in coda e il libro arrivano su disco
+        ai_agent.close()
+        opponent_agent.close()
+        if stats_file is not None: stats_file.close()
+        _close_session(opening_manager, writer, db)
 
-        while not game_over:
-            if moves >= 42:
-                game_over = True
-                winner = "draw"
-                break
+    # Restituisce i dati per la tabella finale
+    return wins, losses, draws
 
-            current_turn = (starting_player + moves) % 2
 
-            if current_turn == 0:
-                move = None
-                if opening_manager: move, _ = opening_manager.get_best_move(engine)
-                if move is None: move = ai_agent.choose_move(0)
+def run_batch_training_session(opponent_type="casual", iterations=200, silent=False):
+    """
+    Come run_training_session, ma gioca tutte le partite insieme su un BatchGameEngine.
+    A ogni ply il bot riceve in un colpo solo tutte le scacchiere in cui tocca a lui
+    (choose_moves: vettoriale per i bot a depth <= 2 come il Casual), l'IA le gioca
+    una alla volta. Profiler, Opening Book e DB sono condivisi tra le partite;
+    le TT non vengono svuotate tra una partita e l'altra perché sono interlacciate.
+    :return: (wins, losses, draws)
+    """
+    engine = GameEngine()
 
-                if move is None:
-                    game_over = True
-                    winner = "draw"
-                else:
-                    if opening_manager: opening_manager.record_move(engine, move, 0)
-                    engine.drop_piece(move, 0)
-            else:
-                state_before = engine.get_state()
-                move = opponent_agent.choose_move(1)
+    try:
+        db = GamePersistence()
+    except Exception:
+        db = None
 
-                if move is None:
-                    game_over = True
-                    winner = "draw"
-                else:
-                    if opening_manager: opening_manager.record_move(engine, move, 1)
-                    engine.drop_piece(move, 1)
-                    profiler.update(state_before, move, 1)
+    profiler = OpponentProfiler()
+    if db:
+        past_biases = db.get_latest_biases(_opponent_key(opponent_type))
+        if past_biases:
+            profiler.set_biases(past_biases)
+
+    ai_agent = MinimaxAgent(engine, AdaptiveEvaluator(profiler), depth=4)
+    opp_evaluator, opp_depth, opp_temperature = _opponent_config(opponent_type)
+    # Un solo RNG per bot, condiviso dalle partite interlacciate: il seed è quello della sessione
+    seed = random.getrandbits(31)
+    opponent_agent = MinimaxAgent(engine, opp_evaluator, depth=opp_depth, temperature=opp_temperature, seed=seed)
+
+    batch = BatchGameEngine(iterations)
+    # Log delle mosse: riga = partita, colonna = ply
+    move_logs = np.zeros((iterations, 42), dtype=np.uint8)
+    # Come nella sessione seriale: la partita i (da 1) inizia con l'IA se i è dispari
+    starting_player = np.array([0 if i % 2 != 0 else 1 for i in range(1, iterations + 1)], dtype=np.int64)
+    # Un solo libro (cache condivisa), una storia delle mosse per partita.
+    # Le scritture vanno al thread di persistenza: il ciclo non attende il disco
+    writer = AsyncPersistenceWriter(db) if db else None
+    opening_manager = OpeningManager(writer) if writer else None
+    histories = [[] for _ in range(iterations)]
 
-            moves += 1
-            if not game_over:
-                if engine.check_victory(current_turn):
-                    game_over = True
-                    winner = "ai" if current_turn == 0 else "bot"
-                elif len([c for c in range(7) if engine.is_valid_location(c)]) == 0:
-                    game_over = True
-                    winner = "draw"
+    progress_step = max(1, iterations // 10)
+    finished = 0
+    wins = 0
+    draws = 0
+    losses = 0
 
-        # Backpropagation
-        if opening_manager and winner is not None:
-            w_idx = 0 if winner == "ai" else (1 if winner == "bot" else "draw")
-            opening_manager.finalize_game(w_idx)
-
-        # Stats Update
-        result = "loss" if winner == "bot" else ("win" if winner == "ai" else "draw")
-
-        if result == "loss": profiler.cooling_after_loss()
-
-        if winner == "ai":
-            wins += 1
-        elif winner == "bot":
-            losses += 1
-        else:
-            draws += 1
-
-        if db:
-            db.save_game_result(opponent_type, result, profiler.get_adaptive_weights(), moves)
-
-        # --- GESTIONE OUTPUT SILENZIOSO / PROGRESSO ---
-        if not silent:
-            # Vecchio comportamento: stampa tutto
-            icon = "🟢" if winner == "ai" else ("🔴" if winner == "bot" else "⚪")
-            print(f"Match {i:03d} {icon} | {result.upper()} | Moves: {moves}")
-        else:
-            # Nuovo comportamento: Stampa solo al 10, 20, 30... %
-            if i % progress_step == 0 or i == iterations:
-                percent = (i / iterations) * 100
-                print(f"   ... Progresso: {percent:.0f}% ({i}/{iterations}) completato.")
+    try:
+        while not batch.done.all():
+            active = np.flatnonzero(~batch.done)
+            turn = (starting_player[active] + batch.counter[active]) % 2
+            ai_boards = active[turn == 0]
+            bot_boards = active[turn == 1]
+
+            # --- IA: prima il libro, poi il Minimax sulle scacchiere rimaste ---
+            ai_moves = np.full(len(ai_boards), -1, dtype=np.int64)
+            if opening_manager:
+                for k, i in enumerate(ai_boards):
+                    engine.set_state(batch.get_state(i))
+                    move, _ = opening_manager.get_best_move(engine)
+                    if move is not None: ai_moves[k] = move
+            searched = ai_moves < 0
+            if searched.any():
+                ai_moves[searched] = ai_agent.choose_moves(batch, 0, ai_boards[searched])
+
+            # --- BOT: tutte le scacchiere insieme ---
+            states_before = [batch.get_state(i) for i in bot_boards]
+            bot_moves = opponent_agent.choose_moves(batch, 1, bot_boards)
+
+            for k, i in enumerate(ai_boards):
+                if opening_manager:
+                    engine.set_state(batch.get_state(i))
+                    opening_manager.record_move(engine, int(ai_moves[k]), 0, histories[i])
+            for k, i in enumerate(bot_boards):
+                move = int(bot_moves[k])
+                if opening_manager:
+                    engine.set_state(states_before[k])
+                    opening_manager.record_move(engine, move, 1, histories[i])
+                profiler.update(states_before[k], move, 1)
+
+            boards = np.concatenate([ai_boards, bot_boards])
+            cols = np.concatenate([ai_moves, bot_moves])
+            move_logs[boards, batch.counter[boards]] = cols
+            batch.drop(boards, cols, np.concatenate([np.zeros(len(ai_boards), dtype=np.int64),
+                                                     np.ones(len(bot_boards), dtype=np.int64)]))
+
+            # --- PARTITE CONCLUSE IN QUESTO PLY ---
+            for i in active[batch.done[active]]:
+                winner = int(batch.winner[i])
+                if opening_manager:
+                    opening_manager.finalize_game("draw" if winner < 0 else winner, histories[i])
+
+                result = "loss" if winner == 1 else ("win" if winner == 0 else "draw")
+                if result == "loss": profiler.cooling_after_loss()
+
+                if winner == 0:
+                    wins += 1
+                elif winner == 1:
+                    losses += 1
+                else:
+                    draws += 1
+
+                moves = int(batch.counter[i])
+                if writer:
+                    writer.save_game_result(opponent_type, result, profiler.get_adaptive_weights(), moves,
+                                            move_logs[i, :moves].tobytes(), int(starting_player[i]), seed)
+
+                finished += 1
+                if not silent:
+                    icon = "🟢" if winner == 0 else ("🔴" if winner == 1 else "⚪")
+                    print(f"Match {i + 1:03d} {icon} | {result.upper()} | Moves: {moves}")
+                elif finished % progress_step == 0 or finished == iterations:
+                    percent = (finished / iterations) * 100
+                    print(f"   ... Progresso: {percent:.0f}% ({finished}/{iterations}) completato.")
+    finally:
+        # Anche su eccezione o Ctrl-C: le partite in coda e il libro arrivano su disco
+        ai_agent.close()
+        opponent_agent.close()
+        _close_session(opening_manager, writer, db)
 
-    # Restituisce i dati per la tabella finale
     return wins, losses, draws
 
 